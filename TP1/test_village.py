@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from village import Village, VectorizedVillage
+
+SEEDS = 30
+STEPS = 10
+
+
+def final_reporters(model_cls, params, seed):
+    model = model_cls(*params, seed=seed, headless=True)
+    model.run(STEPS)
+    return [values[-1] for values in model.datacollector.model_vars.values()]
+
+
+@pytest.mark.parametrize("params", [(25, 5, 1, 2), (400, 60, 10, 20)])
+def test_vectorized_village_matches_village(params):
+    # Les deux moteurs doivent donner les mêmes moyennes de reporters (test z sur SEEDS graines indépendantes)
+    reference = np.array([final_reporters(Village, params, seed) for seed in range(SEEDS)], dtype=float)
+    vectorized = np.array([final_reporters(VectorizedVillage, params, seed) for seed in range(SEEDS)], dtype=float)
+    error = np.sqrt((reference.var(axis=0, ddof=1) + vectorized.var(axis=0, ddof=1)) / SEEDS) + 1e-9
+    z = np.abs(reference.mean(axis=0) - vectorized.mean(axis=0)) / error
+    assert (z < 4).all(), z
+
+
+def test_columnar_collector_reads_mid_run(tmp_path):
+    # Lire les données en cours de run ne ferme pas le collecteur : les steps suivants sont encore collectés
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "village.parquet"
+    model = Village(25, 5, 1, 2, seed=0, collector_path=str(path), headless=True)
+    model.datacollector.chunk_size = 3
+    for _ in range(5):
+        model.step()
+    assert list(model.datacollector.get_model_vars_dataframe().index) == list(range(5))
+    model.run(4)
+    assert list(model.datacollector.get_model_vars_dataframe().index) == list(range(9))
+    assert list(tmp_path.iterdir()) == [path]
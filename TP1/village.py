@@ -1,38 +1,75 @@
+import array
+import itertools
 import math
+import multiprocessing
+import os
 import random
-import uuid
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import mesa
+import numpy as np
+import pandas as pd
 import tornado, tornado.ioloop
 from mesa import space
 from mesa.time import RandomActivation
 from mesa.visualization.ModularVisualization import ModularServer, VisualizationElement
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow n'est nécessaire que pour ColumnarDataCollector
+    pa = pq = None
+
 #from IPython.display import display
 
-evaluationFunctions = {"population": lambda m : m.schedule.get_agent_count(), "non-lycanthropes": lambda m : m.schedule.get_agent_count()-len([pers for pers in m.schedule.agents if isinstance(pers, Villager) and pers.isLycanthrope == True]),"lycanthropes": lambda m : len([pers for pers in m.schedule.agents if isinstance(pers, Villager) and pers.isLycanthrope == True]), 'loups-garous': lambda m : len([pers for pers in m.schedule.agents if isinstance(pers, Villager) and pers.isLycanthrope == True and pers.isTransformed == True])}
+CELL_SIZE = 40  # plus grand rayon d'action (attaque et chasse à 40, soin à 30)
+TRANSFORMATION_PROBA = 0.1
+SAMPLES = 32  # propositions de cible tirées par acteur et par step dans le moteur vectorisé
+
+# Rôles du moteur vectorisé
+VILLAGER, CLERIC, HUNTER = 0, 1, 2
+
+evaluationFunctions = {"population": lambda m : m.schedule.get_agent_count(), "non-lycanthropes": lambda m : m.schedule.get_agent_count()-m.nb_lycanthropes,"lycanthropes": lambda m : m.nb_lycanthropes, 'loups-garous': lambda m : m.nb_werewolves}
 
 class Village(mesa.Model):
 
-    def __init__(self, n_villagers, n_lycanthropes, n_clerics, n_hunters):
+    def __init__(self, n_villagers, n_lycanthropes, n_clerics, n_hunters, seed=None, collector_path=None,
+                 headless=False):
         mesa.Model.__init__(self)
+        self.seed = seed
+        self.headless = headless  # aucun portrayal, aucun affichage : pour les runs batch et benchmarks
+        self.random = random.Random(seed)  # flux aléatoire propre au modèle (aussi utilisé par RandomActivation)
         self.space = mesa.space.ContinuousSpace(600, 600, False)
         self.schedule = RandomActivation(self)
+        self.grid = SpatialHash(CELL_SIZE)
+        # compteurs tenus à jour à chaque infection, soin, transformation et mort (lus par les reporters)
+        self.nb_lycanthropes = n_lycanthropes
+        self.nb_werewolves = 0
         for _ in range(n_villagers):
-            self.schedule.add(Villager(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
+            self.add_agent(Villager(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
         for _ in range(n_lycanthropes):
-            self.schedule.add(Villager(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self, True))
+            self.add_agent(Villager(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self, True))
         for _ in range(n_clerics):
-            self.schedule.add(Cleric(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
+            self.add_agent(Cleric(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
         for _ in range(n_hunters):
-            self.schedule.add(Hunter(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
+            self.add_agent(Hunter(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
 
         
-        self.datacollector = mesa.DataCollector(model_reporters=evaluationFunctions)
+        if collector_path is None:
+            self.datacollector = mesa.DataCollector(model_reporters=evaluationFunctions)
+        else:
+            self.datacollector = ColumnarDataCollector(evaluationFunctions, collector_path)
 
         self.running = True
 
+    def add_agent(self, agent):
+        self.schedule.add(agent)
+        self.grid.add(agent)
+
+    def remove_agent(self, agent):
+        self.schedule.remove(agent)
+        self.grid.remove(agent)
+
     def step(self):
         self.schedule.step()
 
@@ -41,6 +78,163 @@ class Village(mesa.Model):
 
         if self.schedule.steps >= 1000:
             self.running = False
+            if isinstance(self.datacollector, ColumnarDataCollector):
+                self.datacollector.close()
+
+    def run(self, max_steps=None, stop=None):
+        return run_model(self, max_steps, stop)
+
+
+class SpatialHash:
+    # Grille de cellules carrées : une requête de rayon r ne parcourt que les cellules voisines
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(dict)  # dict utilisé comme ensemble ordonné (retrait en O(1))
+        self.agent_cells = dict()
+
+    def cell(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def add(self, agent):
+        key = self.cell(agent.pos)
+        self.cells[key][agent] = None
+        self.agent_cells[agent] = key
+
+    def remove(self, agent):
+        key = self.agent_cells.pop(agent)
+        del self.cells[key][agent]
+
+    def move(self, agent, pos):
+        agent.pos = pos
+        key = self.cell(pos)
+        old_key = self.agent_cells[agent]
+        if key != old_key:
+            del self.cells[old_key][agent]
+            self.cells[key][agent] = None
+            self.agent_cells[agent] = key
+
+    def neighbours(self, pos, radius):
+        cx, cy = self.cell(pos)
+        reach = math.ceil(radius / self.cell_size)
+        radius2 = radius * radius
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                cell = self.cells.get((i, j))
+                if cell:
+                    for agent in cell:
+                        if (pos[0] - agent.pos[0]) ** 2 + (pos[1] - agent.pos[1]) ** 2 < radius2:
+                            yield agent
+
+
+def cell_ranges(sources, targets, radius):
+    # Cibles triées par cellule de côté radius et, pour chaque source, les plages (début, nombre) de ce tri couvrant les
+    # 3 x 3 cellules autour de la sienne : toute cible à moins de radius d'une source est dans l'une de ses 9 plages
+    if len(sources) == 0 or len(targets) == 0:
+        empty = np.zeros((len(sources), 9), dtype=np.int64)
+        return np.empty(0, dtype=np.intp), empty, empty
+    source_cells = np.floor(sources / radius).astype(np.int64) + 1
+    target_cells = np.floor(targets / radius).astype(np.int64) + 1
+    width = int(max(source_cells[:, 1].max(), target_cells[:, 1].max())) + 2
+    target_ids = target_cells[:, 0] * width + target_cells[:, 1]
+    order = np.argsort(target_ids, kind="stable")
+    sorted_ids = target_ids[order]
+    shifts = np.array([dx * width + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    ids = (source_cells[:, 0] * width + source_cells[:, 1])[:, None] + shifts
+    starts = np.searchsorted(sorted_ids, ids, "left")
+    return order, starts, np.searchsorted(sorted_ids, ids, "right") - starts
+
+
+class ColumnarDataCollector:
+    # Variante de mesa.DataCollector pour les longues séries : les valeurs des reporters sont tamponnées dans des
+    # tableaux typés puis écrites par blocs, la mémoire reste constante pendant le run. Chaque bloc est un fichier
+    # Parquet complet (path.part0, path.part1, ...), lisible en cours de run ; close() les réunit dans path
+    def __init__(self, model_reporters, path, chunk_size=1024):
+        if pq is None:
+            raise ImportError("ColumnarDataCollector requires pyarrow")
+        self.model_reporters = model_reporters
+        self.path = path
+        self.chunk_size = chunk_size
+        self.schema = pa.schema([("Step", pa.int64())] + [(label, pa.float64()) for label in model_reporters])
+        self.model_vars = {label: deque(maxlen=1) for label in model_reporters}  # dernière valeur, lue par ChartModule
+        self.parts = []
+        self.closed = False
+        self.n_rows = 0
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.steps = array.array("q")
+        self.buffers = {label: array.array("d") for label in self.model_reporters}
+
+    def _buffer_table(self):
+        columns = [pa.array(np.frombuffer(self.steps, dtype=np.int64))]
+        columns += [pa.array(np.frombuffer(self.buffers[label], dtype=np.float64)) for label in self.model_reporters]
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def collect(self, model):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        self.steps.append(self.n_rows)
+        for label, reporter in self.model_reporters.items():
+            value = reporter(model)
+            self.buffers[label].append(value)
+            self.model_vars[label].append(value)
+        self.n_rows += 1
+        if len(self.steps) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        if not self.steps:
+            return
+        part = "{}.part{}".format(self.path, len(self.parts))
+        pq.write_table(self._buffer_table(), part)
+        self.parts.append(part)
+        self._reset_buffers()
+
+    def close(self):
+        # réunit les blocs écrits et le tampon dans path, bloc par bloc, puis supprime les blocs
+        if self.closed:
+            return
+        with pq.ParquetWriter(self.path, self.schema) as writer:
+            for part in self.parts:
+                writer.write_table(pq.read_table(part))
+            writer.write_table(self._buffer_table())
+        for part in self.parts:
+            os.remove(part)
+        self.parts = []
+        self._reset_buffers()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_model_vars_dataframe(self):
+        # en cours de run : blocs déjà écrits et tampon, sans fermer le collecteur
+        if self.closed:
+            table = pq.read_table(self.path)
+        else:
+            table = pa.concat_tables([pq.read_table(part) for part in self.parts] + [self._buffer_table()])
+        return table.to_pandas().set_index("Step")
+
+
+def run_model(model, max_steps=None, stop=None):
+    # Boucle serrée (batch, CI) : jusqu'à la fin du modèle, au budget de pas ou quand stop(model) est vrai.
+    # Le fichier du ColumnarDataCollector est fermé en sortie, même si le modèle n'a pas atteint sa fin
+    steps = 0
+    try:
+        while model.running and (max_steps is None or steps < max_steps):
+            model.step()
+            steps += 1
+            if stop is not None and stop(model):
+                break
+    finally:
+        if isinstance(model.datacollector, ColumnarDataCollector):
+            model.datacollector.close()
+    return steps
 
 
 class ContinuousCanvas(VisualizationElement):
@@ -65,6 +259,8 @@ class ContinuousCanvas(VisualizationElement):
 
     def render(self, model):
         representation = defaultdict(list)
+        if model.headless:
+            return representation
         for obj in model.schedule.agents:
             portrayal = self.portrayal_method(obj)
             if portrayal:
@@ -77,7 +273,7 @@ class ContinuousCanvas(VisualizationElement):
 
 
 def wander(x, y, speed, model):
-    r = random.random() * math.pi * 2
+    r = model.random.random() * math.pi * 2
     new_x = max(min(x + math.cos(r) * speed, model.space.x_max), model.space.x_min)
     new_y = max(min(y + math.sin(r) * speed, model.space.y_max), model.space.y_min)
 
@@ -111,21 +307,26 @@ class Villager(mesa.Agent):
         return portrayal
 
     def step(self):
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+        self.model.grid.move(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
 
         if not self.isTransformed:
-            p=0.1
-            self.isTransformed = random.random() < p
+            p=TRANSFORMATION_PROBA
+            self.isTransformed = self.random.random() < p
+            if self.isTransformed and self.isLycanthrope:
+                self.model.nb_werewolves += 1
 
         if self.isTransformed:
             self.attack()
 
 
     def attack(self):
-        proies = [villager for villager in self.model.schedule.agents if isinstance(villager, Villager) and villager.isLycanthrope == False and math.sqrt((self.pos[0]-villager.pos[0])**2 + (self.pos[1]-villager.pos[1])**2) < 40 ]
+        proies = [villager for villager in self.model.grid.neighbours(self.pos, 40) if isinstance(villager, Villager) and villager.isLycanthrope == False]
         if len(proies) > 0:
-            idAttacked = random.randint(0,len(proies)-1)
+            idAttacked = self.random.randint(0,len(proies)-1)
             proies[idAttacked].isLycanthrope = True
+            self.model.nb_lycanthropes += 1
+            if proies[idAttacked].isTransformed:
+                self.model.nb_werewolves += 1
 
 class Cleric(mesa.Agent):
     def __init__(self, x, y, speed, unique_id: int, model: Village):
@@ -148,14 +349,15 @@ class Cleric(mesa.Agent):
         return portrayal
 
     def step(self):
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+        self.model.grid.move(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
         self.heal()
 
     def heal(self):
-        potentialHealed = [villager for villager in self.model.schedule.agents if isinstance(villager, Villager) and villager.isLycanthrope == True and villager.isTransformed == False and math.sqrt((self.pos[0]-villager.pos[0])**2 + (self.pos[1]-villager.pos[1])**2) < 30 ]
+        potentialHealed = [villager for villager in self.model.grid.neighbours(self.pos, 30) if isinstance(villager, Villager) and villager.isLycanthrope == True and villager.isTransformed == False]
         if len(potentialHealed) > 0:
-            idAttacked = random.randint(0,len(potentialHealed)-1)
+            idAttacked = self.random.randint(0,len(potentialHealed)-1)
             potentialHealed[idAttacked].isLycanthrope = False
+            self.model.nb_lycanthropes -= 1
 
 class Hunter(mesa.Agent):
     def __init__(self, x, y, speed, unique_id: int, model: Village):
@@ -178,14 +380,199 @@ class Hunter(mesa.Agent):
         return portrayal
 
     def step(self):
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+        self.model.grid.move(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
         self.kill()
 
     def kill(self):
-        potentialKilled = [villager for villager in self.model.schedule.agents if isinstance(villager, Villager) and villager.isLycanthrope == True and villager.isTransformed == True and math.sqrt((self.pos[0]-villager.pos[0])**2 + (self.pos[1]-villager.pos[1])**2) < 40 ]
+        potentialKilled = [villager for villager in self.model.grid.neighbours(self.pos, 40) if isinstance(villager, Villager) and villager.isLycanthrope == True and villager.isTransformed == True]
         if len(potentialKilled) > 0:
-            idAttacked = random.randint(0,len(potentialKilled)-1)
-            self.model.schedule.remove(potentialKilled[idAttacked])
+            idAttacked = self.random.randint(0,len(potentialKilled)-1)
+            self.model.remove_agent(potentialKilled[idAttacked])
+            self.model.nb_lycanthropes -= 1
+            self.model.nb_werewolves -= 1
+
+
+vectorizedEvaluationFunctions = {"population": lambda m : len(m.role), "non-lycanthropes": lambda m : len(m.role)-int(np.count_nonzero(m.isLycanthrope)), "lycanthropes": lambda m : int(np.count_nonzero(m.isLycanthrope)), 'loups-garous': lambda m : int(np.count_nonzero(m.isLycanthrope & m.isTransformed))}
+
+
+class VectorizedVillage(mesa.Model):
+    # Même dynamique que Village, mais les agents sont des lignes de tableaux NumPy : déplacements, transformations et
+    # recherches de voisins sont calculés par lots. Les actions (attaque, soin, chasse) sont ensuite jouées dans l'ordre
+    # d'activation tiré au hasard, comme RandomActivation : une cible infectée, soignée ou tuée ne l'est qu'une fois et
+    # un agent ne voit que ce qu'ont fait les agents activés avant lui
+    def __init__(self, n_villagers, n_lycanthropes, n_clerics, n_hunters, seed=None, collector_path=None,
+                 headless=False):
+        mesa.Model.__init__(self)
+        self.seed = seed
+        self.headless = headless
+        self.space = mesa.space.ContinuousSpace(600, 600, False)
+        self.rng = np.random.default_rng(seed)
+        n = n_villagers + n_lycanthropes + n_clerics + n_hunters
+        self.pos = self.rng.random((n, 2)) * 500
+        self.speed = 10
+        self.role = np.repeat(np.array([VILLAGER, VILLAGER, CLERIC, HUNTER], dtype=np.int8),
+                              [n_villagers, n_lycanthropes, n_clerics, n_hunters])
+        self.isLycanthrope = np.zeros(n, dtype=bool)
+        self.isLycanthrope[n_villagers:n_villagers + n_lycanthropes] = True
+        self.isTransformed = np.zeros(n, dtype=bool)
+        self.steps = 0
+
+        if collector_path is None:
+            self.datacollector = mesa.DataCollector(model_reporters=vectorizedEvaluationFunctions)
+        else:
+            self.datacollector = ColumnarDataCollector(vectorizedEvaluationFunctions, collector_path)
+
+        self.running = True
+
+    def wander(self):
+        r = self.rng.random(len(self.role)) * math.pi * 2
+        self.pos[:, 0] = np.clip(self.pos[:, 0] + np.cos(r) * self.speed, self.space.x_min, self.space.x_max)
+        self.pos[:, 1] = np.clip(self.pos[:, 1] + np.sin(r) * self.speed, self.space.y_min, self.space.y_max)
+
+    def propose(self, actors, targets, radius, previous, rank):
+        # SAMPLES cibles tirées uniformément, pour chaque acteur, parmi celles des cases autour de lui : sur-ensemble des
+        # cibles à moins de radius au moment où il joue (une cible s'est déplacée d'au plus speed depuis previous). Les
+        # propositions trop loin au moment de l'action (cible à sa nouvelle position si elle a été activée avant
+        # l'acteur, à l'ancienne sinon), ou tirées dans des cases vides, valent -1
+        actors, targets = np.flatnonzero(actors), np.flatnonzero(targets)
+        order, starts, counts = cell_ranges(self.pos[actors], previous[targets], radius + self.speed)
+        total = counts.sum(axis=1)
+        if len(order) == 0:
+            return actors, np.full((len(actors), SAMPLES), -1), total, targets[order], starts, counts
+        ends = counts.cumsum(axis=1)
+        draws = (self.rng.random((len(actors), SAMPLES)) * total[:, None]).astype(np.int64)
+        block = np.minimum((draws[:, :, None] >= ends[:, None, :]).sum(axis=2), 8)
+        rows = np.arange(len(actors))[:, None]
+        position = starts[rows, block] + draws - ends[rows, block] + counts[rows, block]
+        proposed = targets[order[np.minimum(position, len(order) - 1)]]
+        where = np.where((rank[proposed] <= rank[actors][:, None])[..., None], self.pos[proposed], previous[proposed])
+        near = ((self.pos[actors][:, None, :] - where) ** 2).sum(axis=2) < radius * radius
+        return actors, np.where(near & (total > 0)[:, None], proposed, -1), total, targets[order], starts, counts
+
+    def interact(self, previous, rank, transforms):
+        # Joue attaques, soins et chasses dans l'ordre d'activation. Chaque acteur tire sa cible uniformément parmi
+        # celles qui sont valides au moment où il joue, par rejet : ses propositions (propose) sont examinées dans
+        # l'ordre et la première dont l'état (mort, lycanthropie, transformation) convient est retenue ; si aucune ne
+        # convient, les cibles de ses cases sont énumérées par lots. Les attaques ne visent que les non-lycanthropes du
+        # début du step et les soignés du step, rangés par case dans healed et mêlés aux propositions au prorata. Le
+        # travail en Python reste proportionnel au nombre d'acteurs et la mémoire à SAMPLES par acteur. Renvoie le
+        # masque des agents tués
+        villagers = self.role == VILLAGER
+        transformed = self.isTransformed | transforms  # transformés au plus tard à leur propre activation
+        groups = []
+        for kind, actors, targets, radius in (
+                (VILLAGER, villagers & transformed, villagers & ~self.isLycanthrope, 40),
+                (CLERIC, self.role == CLERIC, villagers & ~self.isTransformed, 30),
+                (HUNTER, self.role == HUNTER, villagers & transformed, 40)):
+            groups.append((kind, radius) + self.propose(actors, targets, radius, previous, rank))
+        actors = np.concatenate([group[2] for group in groups])
+        group_of = np.repeat(np.arange(len(groups)), [len(group[2]) for group in groups])
+        row_of = np.concatenate([np.arange(len(group[2])) for group in groups])
+        events = np.argsort(rank[actors], kind="stable")
+        totals = [group[4].tolist() for group in groups]
+        mixes = self.rng.random((len(groups[0][2]), SAMPLES))  # choix entre propositions et soignés, par attaque
+
+        lycanthrope, dead = self.isLycanthrope.copy(), np.zeros(len(rank), dtype=bool)
+        lycanthrope_now, dead_now, lycanthrope_before = lycanthrope.tolist(), dead.tolist(), lycanthrope.tolist()
+        transformed_before, transforms_now, rank_now = self.isTransformed.tolist(), transforms.tolist(), rank.tolist()
+        x_before, y_before = previous[:, 0].tolist(), previous[:, 1].tolist()
+        x_now, y_now = self.pos[:, 0].tolist(), self.pos[:, 1].tolist()
+        reach = 40 + self.speed
+        healed, seen = defaultdict(list), set()  # lycanthropes du début du step soignés depuis, par case de côté reach
+
+        def near(actor, t, time, radius):
+            if rank_now[t] <= time:
+                return (x_now[actor] - x_now[t]) ** 2 + (y_now[actor] - y_now[t]) ** 2 < radius * radius
+            return (x_now[actor] - x_before[t]) ** 2 + (y_now[actor] - y_before[t]) ** 2 < radius * radius
+
+        for actor, group, row, u in zip(actors[events].tolist(), group_of[events].tolist(), row_of[events].tolist(),
+                                        self.rng.random(len(events)).tolist()):
+            if dead_now[actor]:
+                continue
+            kind, radius, _, proposals, _, candidates, starts, counts = groups[group]
+            time, werewolves, size = rank_now[actor], kind == HUNTER, totals[group][row]
+            cells, extra = [], 0
+            if kind == VILLAGER and healed:
+                cx, cy = int(x_now[actor] // reach), int(y_now[actor] // reach)
+                cells = [healed[i, j] for i in (cx - 1, cx, cx + 1) for j in (cy - 1, cy, cy + 1) if (i, j) in healed]
+                extra = sum(len(cell) for cell in cells)
+            target = None
+            for t, mix in zip(proposals[row].tolist(), mixes[row].tolist() if extra else itertools.repeat(0.0)):
+                draw = int(mix * (size + extra))
+                if extra and draw >= size:
+                    # tirage parmi les soignés des cases voisines, au prorata de leur nombre
+                    draw -= size
+                    for cell in cells:
+                        if draw < len(cell):
+                            t = cell[draw]
+                            break
+                        draw -= len(cell)
+                    if not near(actor, t, time, radius):
+                        continue
+                if t < 0 or dead_now[t]:
+                    continue
+                if kind == VILLAGER:
+                    valid = not lycanthrope_now[t]
+                else:
+                    valid = lycanthrope_now[t] and \
+                        (transformed_before[t] or (transforms_now[t] and rank_now[t] < time)) == werewolves
+                if valid:
+                    target = t
+                    break
+            if target is None and size + extra > 0:
+                # aucune proposition retenue : énumération exacte des cibles des cases de l'acteur, dans l'état courant
+                choices = np.concatenate([candidates[start:start + count] for start, count in
+                                          zip(starts[row].tolist(), counts[row].tolist()) if count] or [candidates[:0]])
+                if kind == VILLAGER:
+                    choices = choices[~(lycanthrope[choices] | dead[choices])]
+                else:
+                    choices = choices[lycanthrope[choices] & ~dead[choices]]
+                    choices = choices[(self.isTransformed[choices] |
+                                       (transforms[choices] & (rank[choices] < time))) == werewolves]
+                where = np.where((rank[choices] <= time)[:, None], self.pos[choices], previous[choices])
+                choices = choices[((self.pos[actor] - where) ** 2).sum(axis=1) < radius * radius].tolist()
+                choices += [t for cell in cells for t in cell if not dead_now[t] and not lycanthrope_now[t] and
+                            near(actor, t, time, radius)]
+                if choices:
+                    target = choices[int(u * len(choices))]
+            if target is None:
+                continue
+            if kind == HUNTER:
+                dead[target] = dead_now[target] = True
+                continue
+            lycanthrope[target] = lycanthrope_now[target] = kind == VILLAGER
+            if kind == CLERIC and lycanthrope_before[target] and target not in seen:
+                seen.add(target)
+                healed[int(x_before[target] // reach), int(y_before[target] // reach)].append(target)
+        self.isLycanthrope = lycanthrope
+        return dead
+
+    def step(self):
+        previous = self.pos.copy()
+        rank = self.rng.permutation(len(self.role))  # ordre d'activation du step
+        self.wander()
+
+        transforms = (self.role == VILLAGER) & ~self.isTransformed & \
+            (self.rng.random(len(self.role)) < TRANSFORMATION_PROBA)
+        dead = self.interact(previous, rank, transforms)
+        self.isTransformed |= transforms
+        if dead.any():
+            alive = ~dead
+            self.pos = self.pos[alive]
+            self.role = self.role[alive]
+            self.isLycanthrope = self.isLycanthrope[alive]
+            self.isTransformed = self.isTransformed[alive]
+
+        self.steps += 1
+        self.datacollector.collect(self)
+
+        if self.steps >= 1000:
+            self.running = False
+            if isinstance(self.datacollector, ColumnarDataCollector):
+                self.datacollector.close()
+
+    def run(self, max_steps=None, stop=None):
+        return run_model(self, max_steps, stop)
 
 
 def run_single_server():
@@ -211,14 +598,65 @@ def run_single_server():
     tornado.ioloop.IOLoop.current().stop()
 
 
-def run_batch():
+def parameter_combinations(parameters):
+    # Comme batch_run : les valeurs itérables (hors chaînes) sont balayées, les autres sont fixes
+    ranges = {k: (list(v) if hasattr(v, '__iter__') and not isinstance(v, str) else [v]) for k, v in parameters.items()}
+    for values in itertools.product(*ranges.values()):
+        yield dict(zip(ranges.keys(), values))
+
+
+def replicate_seeds(seed, n):
+    # Une graine indépendante par job, dérivée de la graine du balayage : un job se rejoue seul avec sa graine
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
+def run_replicate(job):
+    model_cls, params, replicate, max_steps, seed = job
+    model = model_cls(**params, seed=seed, headless=True)
+    steps = model.run(max_steps)
+    if steps == 0:
+        model.datacollector.collect(model)
+    row = dict(params)
+    row['replicate'] = replicate
+    row['seed'] = seed
+    row['Step'] = steps
+    row.update({label: values[-1] for label, values in model.datacollector.model_vars.items()})
+    return row
+
+
+def iter_sweep(model_cls, parameters, replicates=1, max_steps=1000, processes=None, chunksize=1, seed=None):
+    # Chaque (combinaison de paramètres, réplique) est un job du pool ; les résultats arrivent dans l'ordre où ils se terminent
+    jobs = [(params, replicate) for params in parameter_combinations(parameters) for replicate in range(replicates)]
+    jobs = [(model_cls, params, replicate, max_steps, job_seed)
+            for (params, replicate), job_seed in zip(jobs, replicate_seeds(seed, len(jobs)))]
+    with multiprocessing.Pool(processes) as pool:
+        for row in pool.imap_unordered(run_replicate, jobs, chunksize):
+            yield row
+
+
+def run_sweep(model_cls, parameters, replicates=1, max_steps=1000, processes=None, chunksize=1, seed=None,
+              callback=None):
+    rows = []
+    for row in iter_sweep(model_cls, parameters, replicates, max_steps, processes, chunksize, seed):
+        rows.append(row)
+        if callback is not None:
+            callback(row)
+    result = pd.DataFrame(rows)
+    if rows:
+        result = result.sort_values(list(parameters) + ['replicate'], ignore_index=True)
+    return result
+
+
+def run_batch(replicates=1, processes=None, seed=None):
 
     plageParams = {'n_villagers': 50, 'n_lycanthropes': 5, 'n_hunters': 1, 'n_clerics': range(0,6,1)}
     #batchrunnerr = mesa.batchrunner.BatchRunner(Village, plageParams, model_reporters = evaluationFunctions)
     #batchrunnerr.run_all()
     #result = batchrunnerr.get_model_vars_dataFrame()
 
-    result = mesa.batchrunner.batch_run(Village, plageParams)
+    #result = mesa.batchrunner.batch_run(Village, plageParams)
+    result = run_sweep(Village, plageParams, replicates=replicates, processes=processes,
+                       chunksize=max(1, replicates // 4), seed=seed)
     print(result)
 
 if __name__ == "__main__":
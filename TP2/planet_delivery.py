@@ -1,14 +1,18 @@
+import array
+import base64
+import heapq
 import json  # Pour la sérialisation/désérialisation des objects
 import math
+import os
 import random
 import string
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import List
 
 import mesa
 import mesa.space
 import numpy as np
-import spade  # Framework multi-agents de messages
+import pandas as pd
 import networkx as nx  # Pour le parcours du réseau de planètes
 from mesa import Agent, Model
 from threading import Lock  # Pour le mutual exclusion
@@ -18,78 +22,162 @@ from mesa.time import RandomActivation
 from mesa.visualization import ModularVisualization
 from mesa.visualization.ModularVisualization import VisualizationElement, ModularServer
 from mesa.visualization.modules import ChartModule
-from spade.behaviour import PeriodicBehaviour, OneShotBehaviour
-from spade.template import Template
-import uuid  # Génération de Unique ID
+
+try:
+    import spade  # Framework multi-agents de messages
+    from spade.behaviour import CyclicBehaviour, PeriodicBehaviour, OneShotBehaviour
+    from spade.template import Template
+except ImportError:  # spade n'est nécessaire que pour le transport "spade" (XMPP)
+    spade = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow n'est nécessaire que pour ColumnarDataCollector
+    pa = pq = None
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy n'est nécessaire que pour l'enchère centrale en affectation optimale
+    linear_sum_assignment = None
 
 NEW_ITEM_PROBA = 0.05
 PROBA_ISSUE_ROAD = 0.05
 ROAD_BRANCHING_FACTOR = 0.5
 WAITING_TIME = 3
+ROUTE_REPAIR_FRACTION = 0.1  # au-delà de cette part de routes modifiées depuis son dernier usage, un arbre de
+                             # routage est recalculé plutôt que réparé
+RECEIVE_TIMEOUT = 10  # secondes : borne l'attente d'un message en mode événementiel (pas de réveil périodique)
+# Codes de forme du format binaire du canvas (doivent correspondre à simple_continuous_canvas.js)
+SHAPES = {"circle": 0, "line": 1, "arrowHead": 2}
 
 
 class PlanetDelivery(mesa.Model):
 
-    def __init__(self, n_planets, n_ships, road_branching_factor):
+    def __init__(self, n_planets, n_ships, road_branching_factor, seed=None, collector_path=None, headless=False,
+                 transport="local", sync_messages=False, receive_mode="event", auction="cnp", assignment="greedy"):
         mesa.Model.__init__(self)
+        if transport == "spade" and spade is None:
+            raise ImportError("spade transport requires spade")
+        if auction == "central" and assignment == "optimal" and linear_sum_assignment is None:
+            raise ImportError("optimal central auction requires scipy")
+        self.seed = seed
+        # "local" : boîtes aux lettres en mémoire (LocalBus), "spade" : agents XMPP, serveur sur localhost requis
+        self.transport = transport
+        # barrière de fin de tour : les messages envoyés au tour t ne sont traités qu'à partir du tour t+1
+        self.sync_messages = sync_messages
+        self.bus = LocalBus(deferred=sync_messages) if transport == "local" else None
+        # "event" : les messages reçus sont poussés dans une file, "poll" : RecvBehav périodique (10 ms) + mutex
+        self.receive_mode = receive_mode
+        # "cnp" : contract-net par messages, "central" : toutes les enchères ouvertes réglées en une passe par le
+        # modèle (assignment "greedy" : meilleure utilité d'abord, "optimal" : somme des utilités maximale)
+        self.auction = auction
+        self.assignment = assignment
+        self.headless = headless  # aucun portrayal, aucun affichage : pour les runs batch et benchmarks
+        self.random = random.Random(seed)  # flux aléatoire propre au modèle (aussi utilisé par RandomActivation)
         self.space = mesa.space.ContinuousSpace(600, 600, False)
         self.schedule = RandomActivation(self)
-        planets = [PlanetManager("planet-" + str(i), [], int(uuid.uuid1()), self,
-                                 random.random() * 600, random.random() * 600)
+        planets = [PlanetManager("planet-" + str(i), [], self.next_id(), self,
+                                 self.random.random() * 600, self.random.random() * 600)
                    for i in range(n_planets)]
-        environment = SpaceRoadNetwork(planets, int(uuid.uuid1()), self, road_branching_factor)
+        environment = SpaceRoadNetwork(planets, self.next_id(), self, road_branching_factor)
         self.schedule.add(environment)
         ships = []
         for i in range(n_ships):
-            starting_point = random.choice(planets)
-            ship = Ship("ship-" + str(i), planets, int(uuid.uuid1()), self,
+            starting_point = self.random.choice(planets)
+            ship = Ship("ship-" + str(i), planets, self.next_id(), self,
                         starting_point.x, starting_point.y, 60, environment)
             ships.append(ship)
             self.schedule.add(ship)
+        self.planets = planets
+        self.ships = ships
+        self.planets_by_id = {p.unique_id: p for p in planets}
+        self.ship_rows = {ship: i for i, ship in enumerate(ships)}  # ligne de chaque vaisseau dans ship_preferences
+        self.ship_preferences = np.array([(s.preference_a, s.preference_b, s.preference_c)
+                                          for s in ships]).reshape(-1, 3)
         for p in planets:
             p.planets = [planet for planet in planets if planet != p]
             p.ships = ships
             self.schedule.add(p)
         self.items = []
         self.computed_items_nb = 0
-        self.datacollector = DataCollector(
-            model_reporters={"items": lambda model: len(model.items),
-                             "Delivered": lambda model: model.computed_items_nb
-                             },
-            agent_reporters={})
+        model_reporters = {"items": lambda model: len(model.items),
+                           "Delivered": lambda model: model.computed_items_nb
+                           }
+        if collector_path is None:
+            self.datacollector = DataCollector(model_reporters=model_reporters, agent_reporters={})
+        else:
+            self.datacollector = ColumnarDataCollector(model_reporters, collector_path)
 
     def step(self):
         self.schedule.step()
+        if self.auction == "central":
+            self.clear_auctions()
+        if self.sync_messages:
+            self.message_barrier()
         self.datacollector.collect(self)
         if self.schedule.steps >= 300:
             self.running = False
+            if isinstance(self.datacollector, ColumnarDataCollector):
+                self.datacollector.close()
 
+    def clear_auctions(self):
+        # Équivalent centralisé du contract-net : un vaisseau libre ne peut enchérir que sur les items de la planète
+        # où il est à quai, son offre est Ship.utility. Les enchères de deux planètes sont donc indépendantes : un bloc
+        # vaisseaux à quai x items ouverts par planète, dont les utilités sont calculées d'un coup
+        for planet in self.planets:
+            if not planet.items_to_ship:
+                continue
+            idle = [ship for ship in planet.docked_ships if ship.item is None]
+            if not idle:
+                continue
+            offers = list(planet.items_to_ship.items())
+            attributes = np.array([(item.a, item.b, item.c) for item, _ in offers])
+            utility = self.ship_preferences[[self.ship_rows[ship] for ship in idle]] @ attributes.T
+            for row, column in self.assign(utility):
+                item, destination = offers[column]
+                del planet.items_to_ship[item]
+                idle[row].item = item
+                idle[row].destination = destination
 
-class Item:
-    @staticmethod
-    def from_json(json_object):  #Désérialisation des items pour le passage par message
-        return Item(json_object['x'], json_object['y'], json_object['a'], json_object['b'], json_object['c'],
-                    json_object['uid'])
+    def assign(self, utility):
+        # couples (ligne, colonne) retenus : meilleure utilité d'abord, ou somme des utilités maximale
+        if self.assignment == "optimal":
+            rows, columns = linear_sum_assignment(utility, maximize=True)
+            return list(zip(rows.tolist(), columns.tolist()))
+        rows, columns = np.unravel_index(np.argsort(-utility, axis=None, kind='stable'), utility.shape)
+        taken_rows, taken_columns = set(), set()
+        pairs = []
+        for r, c in zip(rows.tolist(), columns.tolist()):
+            if r not in taken_rows and c not in taken_columns:
+                taken_rows.add(r)
+                taken_columns.add(c)
+                pairs.append((r, c))
+                if len(pairs) == min(utility.shape):
+                    break
+        return pairs
 
-    def __init__(self, x, y, a=None, b=None, c=None, uid=None):
-        if not a:
-            self.a = random.random()
-        else:
-            self.a = a
-        if not b:
-            self.b = random.random()
+    def message_barrier(self):
+        if self.bus is not None:
+            self.bus.deliver_pending()
         else:
-            self.b = b
-        if not c:
-            self.c = random.random()
-        else:
-            self.c = c
+            for agent in self.schedule.agents:
+                if isinstance(agent, CommunicatingAgent):
+                    agent.communicator.wait_sent()
+
+    def run(self, max_steps=None, stop=None):
+        return run_model(self, max_steps, stop)
+
+
+class Item:
+    def __init__(self, x, y, a, b, c, uid):
+        # attributs et identifiant tirés par la planète émettrice, sur le flux aléatoire du modèle
+        self.a = a
+        self.b = b
+        self.c = c
         self.x = x
         self.y = y
-        if not uid:
-            self.uid = int(uuid.uuid1())
-        else:
-            self.uid = uid
+        self.uid = uid
 
     def __eq__(self, other):
         return isinstance(other, Item) and self.uid == other.uid
@@ -109,58 +197,224 @@ class Item:
         return portrayal
 
 
-class AgentCommunicator(spade.agent.Agent):
-    def __init__(self, jid, password):
-        super().__init__(jid, password)
-        self.msg_box = []
-        self.mutex = Lock()
-        self.send_behaviour = None
+def drain(queue):
+    # Une file par agent (deque) : append côté réception, popleft côté step, sans verrou explicite
+    messages = []
+    while queue:
+        messages.append(queue.popleft())
+    return messages
+
+
+class ContractNetMessage:
+    # Corps typé des messages du contract-net. Sur le bus local l'objet est transmis tel quel ; avec SPADE il est
+    # encodé en une liste JSON compacte [performative, uid, x, y, a, b, c, destination, utilité]
+    __slots__ = ("performative", "item", "destination_id", "utility")
+
+    def __init__(self, performative, item, destination_id, utility=None):
+        self.performative = performative
+        self.item = item
+        self.destination_id = destination_id
+        self.utility = utility
+
+    def encode(self):
+        item = self.item
+        return json.dumps([self.performative, item.uid, item.x, item.y, item.a, item.b, item.c,
+                           self.destination_id, self.utility])
+
+    @staticmethod
+    def decode(text):
+        performative, uid, x, y, a, b, c, destination_id, utility = json.loads(text)
+        return ContractNetMessage(performative, Item(x, y, a, b, c, uid), destination_id, utility)
+
+    @staticmethod
+    def from_message(msg):
+        if isinstance(msg.body, ContractNetMessage):
+            return msg.body
+        return ContractNetMessage.decode(msg.body)
+
+
+class LocalMessage:
+    # Message du transport local : mêmes attributs que spade.message.Message, le corps est transmis tel quel
+    def __init__(self, to=None, sender=None, body=None, thread=None, metadata=None):
+        self.to = to
+        self.sender = sender
+        self.body = body
+        self.thread = thread
+        self.metadata = metadata if metadata is not None else {}
+
+    def __str__(self):
+        return "LocalMessage(to={}, sender={}, thread={}, metadata={}, body={})".format(
+            self.to, self.sender, self.thread, self.metadata, self.body)
+
+
+class LocalBus:
+    # Bus en mémoire : un message posté est ajouté directement à la file (inbox) du destinataire (pas de réseau).
+    # En mode différé, les messages attendent deliver_pending(), appelé par la barrière de fin de tour
+    def __init__(self, deferred=False):
+        self.communicators = dict()
+        self.deferred = deferred
+        self.pending = []
+
+    def register(self, communicator):
+        self.communicators[communicator.jid] = communicator
+
+    def deliver(self, msg):
+        self.communicators[msg.to].inbox.append(msg)
+
+    def post_batch(self, msgs):
+        if self.deferred:
+            self.pending.extend(msgs)
+        else:
+            for msg in msgs:
+                self.deliver(msg)
+
+    def deliver_pending(self):
+        pending, self.pending = self.pending, []
+        for msg in pending:
+            self.deliver(msg)
+
+
+class LocalCommunicator:
+    # Même interface que AgentCommunicator (jid, start, post_batch, wait_sent, drain) au-dessus d'un LocalBus
+    message_class = LocalMessage
+
+    def __init__(self, jid, bus):
+        self.jid = jid
+        self.bus = bus
+        self.inbox = deque()
+        bus.register(self)
 
-    class SendBehaviour(OneShotBehaviour):
-        def __init__(self, msg):
-            super().__init__()
-            self.msg = msg
+    def start(self):
+        pass
 
-        async def run(self):
-            await self.send(self.msg)
-            print("sent: " + str(self.msg) + '\n')
+    def post_batch(self, msgs):
+        self.bus.post_batch(msgs)
 
-    class RecvBehav(PeriodicBehaviour):
-        async def run(self):
-            msg = await self.receive()
-            if msg:
-                self.agent.mutex.acquire()
-                # try:
-                self.agent.msg_box.append(msg)
-                print("received: " + str(msg))
-                # finally:
-                self.agent.mutex.release()
+    def wait_sent(self):
+        pass
 
-    async def setup(self):
-        b = self.RecvBehav(.01)
-        self.add_behaviour(b, Template())
-        print(str(self.jid) + " connected")
+    def drain(self):
+        return drain(self.inbox)
+
+
+if spade is not None:
+    class AgentCommunicator(spade.agent.Agent):
+        message_class = spade.message.Message
+
+        def __init__(self, jid, password, verbose=True, event_driven=True, track_sent=False):
+            super().__init__(jid, password)
+            self.verbose = verbose
+            self.event_driven = event_driven
+            # behaviours d'envoi gardés pour wait_sent, seulement si la barrière de fin de tour les attend : sinon la
+            # liste grandirait d'un behaviour par tour pendant tout le run
+            self.track_sent = track_sent
+            self.inbox = deque()  # mode événementiel
+            self.msg_box = []  # mode scrutation, protégée par mutex
+            self.mutex = Lock()
+            self.send_behaviours = []
+
+        def post_batch(self, msgs):
+            # un seul behaviour pour tous les messages du tour, sans attendre leur envoi (voir wait_sent)
+            behaviour = AgentCommunicator.SendBehaviour(msgs)
+            self.add_behaviour(behaviour)
+            if self.track_sent:
+                self.send_behaviours.append(behaviour)
+
+        def wait_sent(self):
+            behaviours, self.send_behaviours = self.send_behaviours, []
+            for behaviour in behaviours:
+                behaviour.join()
+
+        def drain(self):
+            if self.event_driven:
+                return drain(self.inbox)
+            self.mutex.acquire()
+            try:
+                messages = self.msg_box
+                self.msg_box = []
+            finally:
+                self.mutex.release()
+            return messages
+
+        class SendBehaviour(OneShotBehaviour):
+            def __init__(self, msgs):
+                super().__init__()
+                self.msgs = msgs
+
+            async def run(self):
+                for msg in self.msgs:
+                    await self.send(msg)
+                    if self.agent.verbose:
+                        print("sent: " + str(msg) + '\n')
+
+        class RecvEvent(CyclicBehaviour):
+            # attend le prochain message (réveil à l'arrivée) et le pousse dans la file de l'agent
+            async def run(self):
+                msg = await self.receive(timeout=RECEIVE_TIMEOUT)
+                if msg:
+                    self.agent.inbox.append(msg)
+                    if self.agent.verbose:
+                        print("received: " + str(msg))
+
+        class RecvBehav(PeriodicBehaviour):
+            async def run(self):
+                msg = await self.receive()
+                if msg:
+                    self.agent.mutex.acquire()
+                    # try:
+                    self.agent.msg_box.append(msg)
+                    if self.agent.verbose:
+                        print("received: " + str(msg))
+                    # finally:
+                    self.agent.mutex.release()
+
+        async def setup(self):
+            b = self.RecvEvent() if self.event_driven else self.RecvBehav(.01)
+            self.add_behaviour(b, Template())
+            if self.verbose:
+                print(str(self.jid) + " connected")
 
 
 class CommunicatingAgent(Agent):
     def __init__(self, unique_id: int, model: Model, name: string):
         super().__init__(unique_id, model)
-        self.communicator = AgentCommunicator(name + "@localhost", "password-" + name)
+        if model.transport == "local":
+            self.communicator = LocalCommunicator(name + "@localhost", model.bus)
+        else:
+            self.communicator = AgentCommunicator(name + "@localhost", "password-" + name,
+                                                  verbose=not model.headless,
+                                                  event_driven=model.receive_mode == "event",
+                                                  track_sent=model.sync_messages)
         self.communicator.start()
+        self.outbox = []
+
+    def new_message(self, to, body, thread):
+        # un seul point de construction des messages : encodage du corps seulement si le transport le demande
+        message_class = self.communicator.message_class
+        return message_class(to=to, sender=str(self.communicator.jid),
+                             body=body if message_class is LocalMessage else body.encode(), thread=thread,
+                             metadata={"performative": body.performative, "turn": str(self.model.schedule.steps)})
 
     def send(self, msg):
-        self.communicator.send_behaviour = AgentCommunicator.SendBehaviour(msg)
-        self.communicator.add_behaviour(self.communicator.send_behaviour)
-        self.communicator.send_behaviour.join()
+        self.outbox.append(msg)
+
+    def receive_messages(self):
+        return self.communicator.drain()
+
+    def flush(self):
+        # fin du step de l'agent : tous les messages du tour partent en un seul lot, sans bloquer le thread mesa
+        if self.outbox:
+            self.communicator.post_batch(self.outbox)
+            self.outbox = []
 
 
 class Ship(CommunicatingAgent):
     def __init__(self, name: string, planets: List, unique_id: int, model: PlanetDelivery,
                  x, y, max_speed: float, environment):
         super().__init__(unique_id, model, name)
-        self.preference_a = random.random()
-        self.preference_b = random.random()
-        self.preference_c = random.random()
+        self.preference_a = self.random.random()
+        self.preference_b = self.random.random()
+        self.preference_c = self.random.random()
         self.planets = planets
         self.x = x
         self.y = y
@@ -169,6 +423,8 @@ class Ship(CommunicatingAgent):
         self.potential_destination = None
         self.waypoint = None
         self.previous_point = [p for p in self.planets if (p.x == self.x and p.y == self.y)][0]
+        self.docked_at = None  # planète sur laquelle le vaisseau est à quai, tenue à jour à l'arrivée et au départ
+        self.dock(self.previous_point)
         self.environment = environment
         self.item = None
         self.waiting_for_proposal = False
@@ -181,17 +437,29 @@ class Ship(CommunicatingAgent):
         self.x += movement[0]
         self.y += movement[1]
 
+    def dock(self, planet):
+        self.docked_at = planet
+        planet.docked_ships[self] = None
+
+    def undock(self):
+        del self.docked_at.docked_ships[self]
+        self.docked_at = None
+
     def step(self):
         if self.waypoint is None and self.destination is not None:
-            self.waypoint = nx.dijkstra_path(self.environment.current_graph,
-                                             self.previous_point, self.destination, 'distance')[1]
+            self.waypoint = self.environment.next_hop(self.previous_point, self.destination)
         if self.waypoint is not None:
             self.move_to(self.waypoint, self.max_speed * self.environment.speed_modificator[
                 (self.previous_point, self.waypoint)])
-            self.item.x = self.x
-            self.item.y = self.y
+            if self.docked_at is not None and (self.x, self.y) != (self.docked_at.x, self.docked_at.y):
+                self.undock()
+            if not self.model.headless:  # la position de l'item ne sert qu'à l'affichage
+                self.item.x = self.x
+                self.item.y = self.y
             if (self.x, self.y) == (self.waypoint.x, self.waypoint.y):
                 self.previous_point = self.waypoint
+                if self.docked_at is None:
+                    self.dock(self.waypoint)
                 if self.waypoint == self.destination:
                     # deliver
                     self.waypoint = None
@@ -200,46 +468,35 @@ class Ship(CommunicatingAgent):
                     self.model.computed_items_nb += 1
                     self.item = None
                 else:
-                    self.waypoint = nx.dijkstra_path(self.environment.current_graph,
-                                                     self.previous_point, self.destination,
-                                                     'distance')[1]  # 0 is current planet
-        self.communicator.mutex.acquire()
-        try:
-            messages = [m for m in self.communicator.msg_box]
-            self.communicator.msg_box = []
-        finally:
-            self.communicator.mutex.release()
+                    self.waypoint = self.environment.next_hop(self.previous_point, self.destination)
+        messages = self.receive_messages()
         
         for m in messages:
+            body = ContractNetMessage.from_message(m)  # un seul décodage par message
             #si on a aucun item en cours de livraison, qu'on est pas en attente d'une réponse à une proposition, on peut traiter les demandes qui arrivent
-            if self.item is None and m.metadata['performative'] == "call_for_proposal" and self.waiting_for_proposal==False:  # and\
-                messageBody = m.body.split('|')
-                proposedItem = Item.from_json(json.loads(messageBody[0])) 
-                proposedItemX,proposedItemY = float(messageBody[1]), float(messageBody[2])
-                proposedUtility = self.utility(proposedItem)
-                self.potential_destination = [planet for planet in self.planets if (planet.x==proposedItemX and planet.y==proposedItemY)].pop()
-                message = spade.message.Message(to=str(m.sender),
-                                          sender=str(m.to),
-                                          body=json.dumps(proposedItem.__dict__) + '|' + str(proposedItemX) + '|' + str(proposedItemY) + '|' +str(proposedUtility),
-                                          thread='CNP-' + str(proposedItem),
-                                          metadata={"performative": "proposal",
-                                                    "turn": str(self.model.schedule.steps)})
+            if self.item is None and body.performative == "call_for_proposal" and self.waiting_for_proposal==False:
+                proposedUtility = self.utility(body.item)
+                self.potential_destination = self.model.planets_by_id[body.destination_id]
+                message = self.new_message(str(m.sender),
+                                           ContractNetMessage("proposal", body.item, body.destination_id,
+                                                              proposedUtility),
+                                           'CNP-' + str(body.item.uid))
                 self.send(message)
                 self.waiting_for_proposal = True
 
 
-            if self.item is None and m.metadata['performative'] == "reject_proposal" and self.waiting_for_proposal==True:
+            if self.item is None and body.performative == "reject_proposal" and self.waiting_for_proposal==True:
                 self.waiting_for_proposal = False
                 self.potential_destination = None
 
             
-            if self.item is None and m.metadata['performative'] == "accept_proposal" and self.waiting_for_proposal==True:
-                self.item = Item.from_json(json.loads(m.body.split('|')[0]))
+            if self.item is None and body.performative == "accept_proposal" and self.waiting_for_proposal==True:
+                self.item = body.item
                 self.destination = self.potential_destination
                 self.potential_destination = None
                 self.waiting_for_proposal = False
 
-        
+        self.flush()
 
     def utility(self, item):
         return item.a * self.preference_a + item.b * self.preference_b + item.c * self.preference_c
@@ -261,92 +518,64 @@ class Ship(CommunicatingAgent):
 
 
 class PlanetManager(CommunicatingAgent):
+    static = True  # position et apparence fixes : envoyée une seule fois par le rendu "delta"
+
     def __init__(self, name: string, ships: List, unique_id: int, model, x, y):
         super().__init__(unique_id, model, name)
         self.x = x
         self.y = y
         self.items_to_ship = {}
-        self.waiting_for_proposal = []
         self.ships = ships
-        self.start_times = dict()
-        self.proposals = dict()
+        self.docked_ships = dict()  # vaisseaux à quai (dict ordonné utilisé comme ensemble), tenu à jour par Ship
+        self.deadlines = []  # tas de (step d'expiration, uid) : seuls les appels d'offres échus sont examinés
+        self.pending = dict()  # uid -> item des appels d'offres en cours
+        self.proposals = dict()  # uid -> [(expéditeur, proposition)]
         self.planets = []
 
     def step(self):
-        if random.random() < NEW_ITEM_PROBA:
-            item = Item(self.x, self.y)
+        if self.random.random() < NEW_ITEM_PROBA:
+            item = Item(self.x, self.y, self.random.random(), self.random.random(), self.random.random(),
+                        self.model.next_id())
             self.model.items.append(item)
-            self.items_to_ship[item] = random.choice(self.planets)
+            self.items_to_ship[item] = self.random.choice(self.planets)
+        if self.model.auction == "central":  # les items restent ouverts jusqu'au règlement par le modèle
+            return
         for item in self.items_to_ship:
-            cfps = [spade.message.Message(to=str(a.communicator.jid),
-                                          sender=str(self.communicator.jid),
-                                          body=json.dumps(item.__dict__) + '|' +
-                                               str(self.items_to_ship[item].x) + '|' + str(self.items_to_ship[item].y),
-                                          thread='CNP-' + str(item),
-                                          metadata={"performative": "call_for_proposal",
-                                                    "turn": str(self.model.schedule.steps)}) for
-                    a in self.ships if a.x == self.x and a.y == self.y]
+            cfp = ContractNetMessage("call_for_proposal", item, self.items_to_ship[item].unique_id)
+            cfps = [self.new_message(str(a.communicator.jid), cfp, 'CNP-' + str(item.uid)) for
+                    a in self.docked_ships]
             for c in cfps:
                 self.send(c)
-            self.start_times[item] = self.model.schedule.steps
-            self.proposals[item] = []
-            self.waiting_for_proposal.append(item)
+            heapq.heappush(self.deadlines, (self.model.schedule.steps + WAITING_TIME, item.uid))
+            self.pending[item.uid] = item
+            self.proposals[item.uid] = []
         self.items_to_ship = dict()
-        self.communicator.mutex.acquire()
-        try:
-            messages = [m for m in self.communicator.msg_box]
-            self.communicator.msg_box = []
-        finally:
-            self.communicator.mutex.release()
+        messages = self.receive_messages()
         
         #à chaque step, on met à jour les propositions reçues à partir des messages reçus (par de redondance normalement car la msg_box est refresh à chaque step)
         for m in messages :
-            self.proposals[Item.from_json(json.loads(m.body.split('|')[0]))].append(m)
-
-
-        items_to_del = []
-        #puis, pour chaque item en attente de livraison, si le temps d'attente est écoulé, on procède à l'évaluation des propositions
-        for l, waiting_item in enumerate(self.waiting_for_proposal):
-            waiting_time = self.model.schedule.steps - self.start_times[waiting_item] #calcul du temps d'attente
-            if waiting_time <= WAITING_TIME:
-                #print(self.name + ' is waiting for proposals to send item '+ str(waiting_item)) #si nous sommes encore en attente, on ne fait rien
-                print('en attente')
-
-            if waiting_time > WAITING_TIME: #si on a dépassé le temps d'attente, on vérifie qu'on a des propositions et si oui, on récupère la plus intéressante
-                if len(self.proposals[waiting_item]) > 0:
-                    bestUtility = 0
-                    bestRank = 0
-                    for i in range(len(self.proposals[waiting_item])):
-                        if (float(self.proposals[waiting_item][i].body.split('|')[3]) > float(bestUtility)):
-                            bestRank = i
-                            bestUtility = self.proposals[waiting_item][i].body.split('|')[3]
-                    for j in range(len(self.proposals[waiting_item])):
-                        if (j == bestRank):
-                            mess = spade.message.Message(to=str(self.proposals[waiting_item][j].sender),
-                                sender=str(self.communicator.jid),
-                                body=json.dumps(waiting_item.__dict__) + '|' + str(self.proposals[waiting_item][j].body.split('|')[1]) + '|' + str(self.proposals[waiting_item][j].body.split('|')[2]),
-                                thread='CNP-' + str(waiting_item),
-                                metadata={"performative": "accept_proposal","turn": str(self.model.schedule.steps)})
-                            self.send(mess)
-                        else :
-                            mess = spade.message.Message(to=str(self.proposals[waiting_item][j].sender),
-                                sender=str(self.communicator.jid),
-                                body=json.dumps(waiting_item.__dict__) + '|' + str(self.proposals[waiting_item][j].body.split('|')[1]) + '|' + str(self.proposals[waiting_item][j].body.split('|')[2]),
-                                thread='CNP-' + str(waiting_item),
-                                metadata={"performative": "reject_proposal","turn": str(self.model.schedule.steps)})
-                            self.send(mess)
-
-                else :
-                    self.items_to_ship[waiting_item] = random.choice(self.planets) #je ne sais pas comment retrouver la planète à laquelle il devait être livré de base donc je l'attribue à une planete au hasard
-
-                #on supprime l'objet qu'on a finalement livré (ou qu'on reinjecte car les listes seront remises à jour en début de boucle) des différentes listes
-                items_to_del.append(l)
-                del(self.proposals[waiting_item])
-                del(self.start_times[waiting_item])
-
-        items_to_del.sort(reverse=True)
-        for k in items_to_del:
-            self.waiting_for_proposal.pop(k)
+            body = ContractNetMessage.from_message(m)
+            proposals = self.proposals.get(body.item.uid)
+            if proposals is not None:  # une proposition arrivée après l'échéance est ignorée
+                proposals.append((str(m.sender), body))
+
+        #pour chaque item dont le temps d'attente est écoulé, on procède à l'évaluation des propositions
+        while self.deadlines and self.deadlines[0][0] < self.model.schedule.steps:
+            _, uid = heapq.heappop(self.deadlines)
+            waiting_item = self.pending.pop(uid)
+            proposals = self.proposals.pop(uid)
+            if len(proposals) > 0: #on récupère la proposition la plus intéressante
+                bestRank = max(range(len(proposals)), key=lambda i: proposals[i][1].utility)
+                for j, (sender, proposal) in enumerate(proposals):
+                    performative = "accept_proposal" if j == bestRank else "reject_proposal"
+                    mess = self.new_message(sender,
+                                            ContractNetMessage(performative, waiting_item, proposal.destination_id),
+                                            'CNP-' + str(uid))
+                    self.send(mess)
+            else :
+                self.items_to_ship[waiting_item] = self.random.choice(self.planets) #je ne sais pas comment retrouver la planète à laquelle il devait être livré de base donc je l'attribue à une planete au hasard
+
+        self.flush()
 
     @staticmethod
     def portrayal_method():
@@ -360,6 +589,99 @@ class PlanetManager(CommunicatingAgent):
         return portrayal
 
 
+class ColumnarDataCollector:
+    # Variante de mesa.DataCollector pour les longues séries : les valeurs des reporters sont tamponnées dans des
+    # tableaux typés puis écrites par blocs, la mémoire reste constante pendant le run. Chaque bloc est un fichier
+    # Parquet complet (path.part0, path.part1, ...), lisible en cours de run ; close() les réunit dans path
+    def __init__(self, model_reporters, path, chunk_size=1024):
+        if pq is None:
+            raise ImportError("ColumnarDataCollector requires pyarrow")
+        self.model_reporters = model_reporters
+        self.path = path
+        self.chunk_size = chunk_size
+        self.schema = pa.schema([("Step", pa.int64())] + [(label, pa.float64()) for label in model_reporters])
+        self.model_vars = {label: deque(maxlen=1) for label in model_reporters}  # dernière valeur, lue par ChartModule
+        self.parts = []
+        self.closed = False
+        self.n_rows = 0
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.steps = array.array("q")
+        self.buffers = {label: array.array("d") for label in self.model_reporters}
+
+    def _buffer_table(self):
+        columns = [pa.array(np.frombuffer(self.steps, dtype=np.int64))]
+        columns += [pa.array(np.frombuffer(self.buffers[label], dtype=np.float64)) for label in self.model_reporters]
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def collect(self, model):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        self.steps.append(self.n_rows)
+        for label, reporter in self.model_reporters.items():
+            value = reporter(model)
+            self.buffers[label].append(value)
+            self.model_vars[label].append(value)
+        self.n_rows += 1
+        if len(self.steps) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        if not self.steps:
+            return
+        part = "{}.part{}".format(self.path, len(self.parts))
+        pq.write_table(self._buffer_table(), part)
+        self.parts.append(part)
+        self._reset_buffers()
+
+    def close(self):
+        # réunit les blocs écrits et le tampon dans path, bloc par bloc, puis supprime les blocs
+        if self.closed:
+            return
+        with pq.ParquetWriter(self.path, self.schema) as writer:
+            for part in self.parts:
+                writer.write_table(pq.read_table(part))
+            writer.write_table(self._buffer_table())
+        for part in self.parts:
+            os.remove(part)
+        self.parts = []
+        self._reset_buffers()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_model_vars_dataframe(self):
+        # en cours de run : blocs déjà écrits et tampon, sans fermer le collecteur
+        if self.closed:
+            table = pq.read_table(self.path)
+        else:
+            table = pa.concat_tables([pq.read_table(part) for part in self.parts] + [self._buffer_table()])
+        return table.to_pandas().set_index("Step")
+
+
+def run_model(model, max_steps=None, stop=None):
+    # Boucle serrée (batch, CI) : jusqu'à la fin du modèle, au budget de pas ou quand stop(model) est vrai.
+    # Le fichier du ColumnarDataCollector est fermé en sortie, même si le modèle n'a pas atteint sa fin
+    steps = 0
+    try:
+        while model.running and (max_steps is None or steps < max_steps):
+            model.step()
+            steps += 1
+            if stop is not None and stop(model):
+                break
+    finally:
+        if isinstance(model.datacollector, ColumnarDataCollector):
+            model.datacollector.close()
+    return steps
+
+
 class ContinuousCanvas(VisualizationElement):
     local_includes = [
         "./js/simple_continuous_canvas.js",
@@ -367,11 +689,18 @@ class ContinuousCanvas(VisualizationElement):
     ]
 
     def __init__(self, canvas_height=500,
-                 canvas_width=500, instantiate=True):
+                 canvas_width=500, instantiate=True, render_mode="full", keyframe_interval=0):
         VisualizationElement.__init__(self)
         self.canvas_height = canvas_height
         self.canvas_width = canvas_width
         self.identifier = "space-canvas"
+        # "full" : toute la scène à chaque image, "delta" : seulement les changements, "binary" : colonnes float32
+        self.render_mode = render_mode
+        self.keyframe_interval = keyframe_interval
+        self._model = None
+        self._frame = 0
+        self._scene = dict()
+        self._static = dict()
         if instantiate:
             new_element = ("new Simple_Continuous_Module({}, {},'{}')".
                            format(self.canvas_width, self.canvas_height, self.identifier))
@@ -381,66 +710,278 @@ class ContinuousCanvas(VisualizationElement):
     def portrayal_method(obj):
         return obj.portrayal_method()
 
-    def render(self, model):
-        representation = defaultdict(list)
+    def portrayals(self, model, static=True):
         for obj in model.schedule.agents:
+            if not static and getattr(obj, "static", False):
+                continue
             portrayal = self.portrayal_method(obj)
             if portrayal:
                 if isinstance(obj, SpaceRoadNetwork):
-                    for p in portrayal:
-                        representation[p["Layer"]].append(p)
+                    for p in portrayal:  # une route est identifiée par ses extrémités
+                        yield "road:{}:{}:{}:{}".format(p["from_x"], p["from_y"], p["to_x"], p["to_y"]), p, False
                 else:
                     portrayal["x"] = ((obj.x - model.space.x_min) /
                                       (model.space.x_max - model.space.x_min))
                     portrayal["y"] = ((obj.y - model.space.y_min) /
                                       (model.space.y_max - model.space.y_min))
-                    representation[portrayal["Layer"]].append(portrayal)
+                    yield str(id(obj)), portrayal, getattr(obj, "static", False)
         for obj in model.items:
             portrayal = self.portrayal_method(obj)
             portrayal["x"] = ((obj.x - model.space.x_min) /
                               (model.space.x_max - model.space.x_min))
             portrayal["y"] = ((obj.y - model.space.y_min) /
                               (model.space.y_max - model.space.y_min))
+            yield str(id(obj)), portrayal, False
+
+    def render(self, model):
+        if model.headless:
+            return dict()
+        if self.render_mode == "delta":
+            return self.render_delta(model)
+        if self.render_mode == "binary":
+            return self.render_binary(model)
+        representation = defaultdict(list)
+        for _, portrayal, _ in self.portrayals(model):
             representation[portrayal["Layer"]].append(portrayal)
         return representation
 
+    def render_delta(self, model):
+        # Image complète au premier rendu d'un modèle (et toutes les keyframe_interval images), sinon seulement les
+        # portrayals ajoutés, modifiés ou supprimés depuis l'image précédente ; le décor statique n'est envoyé qu'une fois
+        if model is not self._model:
+            self._model = model
+            self._frame = 0
+        full = self._frame == 0 or (self.keyframe_interval > 0 and self._frame % self.keyframe_interval == 0)
+        if full:
+            self._static = dict()
+        scene = dict(self._static)
+        changed = dict()
+        for key, portrayal, is_static in self.portrayals(model, static=full):
+            scene[key] = portrayal
+            if is_static:
+                self._static[key] = portrayal
+            if full or self._scene.get(key) != portrayal:
+                changed[key] = portrayal
+        removed = [] if full else [key for key in self._scene if key not in scene]
+        self._scene = scene
+        self._frame += 1
+        return {"delta": True, "full": full, "set": changed, "del": removed}
+
+    def render_binary(self, model):
+        # Une couche = un bloc float32 rangé colonne par colonne (x, y, x2, y2, taille, angle, couleur, forme, rempli),
+        # transmis en base64 dans le message JSON de mesa ; le client le relit avec des vues Float32Array
+        palette = dict()
+        layers = defaultdict(list)
+        for _, p, _ in self.portrayals(model):
+            color = palette.setdefault(p["Color"], len(palette))
+            filled = p.get("Filled") == "true"
+            if p["Shape"] == "line":
+                row = (p["from_x"], p["from_y"], p["to_x"], p["to_y"], p["width"], 0, color, SHAPES["line"], filled)
+            elif p["Shape"] == "arrowHead":
+                row = (p["x"], p["y"], 0, 0, p["s"], p["angle"], color, SHAPES["arrowHead"], filled)
+            else:
+                row = (p["x"], p["y"], 0, 0, p["r"], 0, color, SHAPES["circle"], filled)
+            layers[p["Layer"]].append(row)
+        blocks = dict()
+        for layer, rows in layers.items():
+            columns = np.array(rows, dtype="<f4").T.copy()
+            blocks[layer] = {"n": len(rows), "data": base64.b64encode(columns.tobytes()).decode("ascii")}
+        return {"binary": True, "palette": list(palette), "layers": blocks}
+
+
+def sample_pairs(n, p, rng):
+    # Chaque paire (i, j), j < i, est tirée avec probabilité p. Au lieu d'un tirage par paire (O(n²)), on saute
+    # directement à la paire retenue suivante : l'écart suit une loi géométrique de paramètre p (O(n + E))
+    if p <= 0:
+        return
+    if p >= 1:
+        yield from ((i, j) for i in range(n) for j in range(i))
+        return
+    log_q = math.log(1.0 - p)
+    i, j = 1, -1
+    while i < n:
+        j += 1 + int(math.log(1.0 - rng.random()) / log_q)
+        while j >= i and i < n:
+            j -= i
+            i += 1
+        if i < n:
+            yield i, j
+
+
+def bridging_pairs(n, pairs, rng):
+    # Union-find (compression de chemin) sur les paires tirées, puis une route entre deux planètes prises au hasard
+    # dans chaque couple de composantes consécutives : le graphe devient connexe en une passe
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    components = defaultdict(list)
+    for i in range(n):
+        components[find(i)].append(i)
+    # composantes dans l'ordre de leur plus petit indice : reproductible pour une graine donnée
+    members = [components[root] for root in sorted(components)]
+    return [(rng.choice(first), rng.choice(second)) for first, second in zip(members, members[1:])]
+
+
+class ShortestPathTree:
+    # Arbre des plus courts chemins (en temps de parcours) vers destination : distance et prochain saut de chaque
+    # planète joignable, enfants de chaque planète pour détacher un sous-arbre, et version du journal des routes prise
+    # en compte
+    def __init__(self, destination, version):
+        self.dist = {destination: 0.0}
+        self.next_hops = dict()
+        self.children = defaultdict(set)
+        self.version = version
+
+    def attach(self, planet, via, distance):
+        previous = self.next_hops.get(planet)
+        if previous is not None:
+            self.children[previous].discard(planet)
+        self.dist[planet] = distance
+        self.next_hops[planet] = via
+        self.children[via].add(planet)
+
+    def detach(self, root):
+        # retire root et tout le sous-arbre qui passe par lui ; renvoie les planètes retirées
+        self.children[self.next_hops[root]].discard(root)
+        detached = [root]
+        for planet in detached:
+            detached.extend(self.children.pop(planet, ()))
+        for planet in detached:
+            del self.dist[planet]
+            del self.next_hops[planet]
+        return detached
+
 
 class SpaceRoadNetwork(Agent):
     def __init__(self, planets: List[PlanetManager], unique_id: int, model: Model, road_branching_factor):
         super().__init__(unique_id, model)
+        pairs = list(sample_pairs(len(planets), road_branching_factor, self.random))
+        pairs += bridging_pairs(len(planets), pairs, self.random)
+        roads = [(planets[i], planets[j], math.hypot(planets[i].x - planets[j].x, planets[i].y - planets[j].y))
+                 for i, j in pairs]
         self.initial_graph = nx.Graph()
+        self.initial_graph.add_nodes_from(planets)
+        self.initial_graph.add_weighted_edges_from(roads, weight='distance')
         self.current_graph = nx.Graph()
-        self.speed_modificator = dict()
-        for i in range(len(planets)):
-            self.initial_graph.add_node(planets[i])
-            for j in range(i):
-                #if random.random() < ROAD_BRANCHING_FACTOR:
-                if random.random() < road_branching_factor:
-                    distance = np.linalg.norm([planets[i].x - planets[j].x, planets[i].y - planets[j].y])
-                    self.initial_graph.add_edge(planets[i], planets[j], distance=distance)
-        # Reconnect graph of the roads between planets
-        while len(list(nx.connected_components(self.initial_graph))) != 1:
-            first_element = random.choice(tuple(list(nx.connected_components(self.initial_graph))[0]))
-            second_element = random.choice(tuple(list(nx.connected_components(self.initial_graph))[1]))
-            distance = np.linalg.norm([first_element.x - second_element.x, first_element.y - second_element.y])
-            self.initial_graph.add_edge(first_element, second_element, distance=distance)
-        for e in self.initial_graph.edges:
-            self.current_graph.add_edge(e[0], e[1],
-                                        distance=nx.get_edge_attributes(self.initial_graph, 'distance')[(e[0], e[1])])
-            self.speed_modificator[e] = 1.0
-            self.speed_modificator[(e[1], e[0])] = 1.0
-        print('foo')
+        self.current_graph.add_nodes_from(planets)
+        # weight : temps de parcours, distance / modificateur de vitesse (infini si la route est fermée)
+        self.current_graph.add_edges_from((a, b, {'distance': d, 'weight': d}) for a, b, d in roads)
+        self.speed_modificator = {road: 1.0 for a, b, _ in roads for road in ((a, b), (b, a))}
+        # temps de parcours en dictionnaires simples (planète -> voisin -> poids) : parcourus par Dijkstra et les
+        # réparations, bien plus vite que les vues de networkx
+        self.adjacency = {planet: dict() for planet in planets}
+        for a, b, d in roads:
+            self.adjacency[a][b] = self.adjacency[b][a] = d
+        # destination -> ShortestPathTree, réparé seulement quand next_hop le consulte
+        self.routes = dict()
+        # journal des changements de routes (a, b, poids avant le changement), numérotés à partir de log_start
+        self.road_log = []
+        self.log_start = 0
+
+    def version(self):
+        return self.log_start + len(self.road_log)
+
+    def repair_limit(self):
+        return ROUTE_REPAIR_FRACTION * self.current_graph.number_of_edges()
+
+    def next_hop(self, source, destination):
+        # arbre calculé au premier trajet vers destination, puis réparé à la demande avec les changements de routes
+        # survenus depuis son dernier usage (recalculé s'il y en a trop) : None si destination est injoignable
+        route = self.routes.get(destination)
+        if route is None or self.version() - route.version > self.repair_limit():
+            route = self.routes[destination] = self.shortest_path_tree(destination)
+        elif route.version < self.version():
+            self.repair(route)
+        return route.next_hops.get(source)
+
+    def shortest_path_tree(self, destination):
+        # graphe non orienté : sur l'arbre des plus courts chemins issu de destination, le prédécesseur d'une planète
+        # est son prochain saut vers destination
+        route = ShortestPathTree(destination, self.version())
+        self.propagate(route, [(0.0, destination.unique_id, destination)])
+        return route
+
+    def propagate(self, route, heap):
+        # Dijkstra à partir des planètes du tas (entrées périmées ignorées) ; les routes fermées ont un poids infini
+        dist = route.dist
+        while heap:
+            d, _, planet = heapq.heappop(heap)
+            if d > dist.get(planet, math.inf):
+                continue
+            for neighbour, weight in self.adjacency[planet].items():
+                new_dist = d + weight
+                if new_dist < dist.get(neighbour, math.inf):
+                    route.attach(neighbour, planet, new_dist)
+                    heapq.heappush(heap, (new_dist, neighbour.unique_id, neighbour))
+
+    def repair(self, route):
+        # Réparation groupée des changements survenus depuis route.version, comparés aux poids d'alors : les
+        # sous-arbres suspendus à une route ralentie ou fermée sont détachés puis rattachés à leurs voisins intacts,
+        # les routes accélérées sont relâchées depuis leurs extrémités, puis Dijkstra repart de ces seules planètes
+        before = dict()
+        for a, b, weight in self.road_log[route.version - self.log_start:]:
+            before.setdefault((a, b), weight)
+        route.version = self.version()
+        dist, next_hops = route.dist, route.next_hops
+        detached = []
+        for (a, b), weight in before.items():
+            if self.adjacency[a][b] > weight:
+                for planet, via in ((a, b), (b, a)):
+                    if next_hops.get(planet) is via:
+                        detached.extend(route.detach(planet))
+        heap = []
+        for planet in detached:
+            for neighbour, weight in self.adjacency[planet].items():
+                if neighbour in dist and dist[neighbour] + weight < dist.get(planet, math.inf):
+                    route.attach(planet, neighbour, dist[neighbour] + weight)
+            if planet in dist:
+                heapq.heappush(heap, (dist[planet], planet.unique_id, planet))
+        for (a, b), weight in before.items():
+            if self.adjacency[a][b] < weight:
+                for planet, via in ((a, b), (b, a)):
+                    if via in dist and dist[via] + self.adjacency[a][b] < dist.get(planet, math.inf):
+                        route.attach(planet, via, dist[via] + self.adjacency[a][b])
+                        heapq.heappush(heap, (dist[planet], planet.unique_id, planet))
+        self.propagate(route, heap)
+
+    def invalidate_routes(self):
+        self.routes = dict()
+        self.road_log = []
+        self.log_start = 0
+
+    def set_road_state(self, road, state):
+        a, b = road
+        self.speed_modificator[road] = state                    #permet de modifier dans un sens de la route
+        self.speed_modificator[(b, a)] = state                  #puis dans l'autre
+        attributes = self.current_graph.edges[road]
+        self.road_log.append((a, b, attributes['weight']))
+        attributes['weight'] = attributes['distance'] / state if state > 0 else math.inf
+        self.adjacency[a][b] = self.adjacency[b][a] = attributes['weight']
 
     def step(self):
         #to do
         road_states = [0.0, 0.5, 1.0]
-        for road, state in self.current_graph.edges.items():
-            p = random.random()
+        for road in self.current_graph.edges:
+            p = self.random.random()
             if p<PROBA_ISSUE_ROAD:
-                new_state = random.choice([n for n in road_states if n!=state])
-                print(new_state)
-                self.speed_modificator[road]=new_state                  #permet de modifier dans un sens de la route
-                self.speed_modificator[(road[1], road[0])]=new_state    #puis dans l'autre
+                new_state = self.random.choice([n for n in road_states if n!=self.speed_modificator[road]])
+                if not self.model.headless:
+                    print(new_state)
+                self.set_road_state(road, new_state)
+        # les arbres trop en retard seront recalculés de toute façon : ils sont oubliés, et le journal raccourci
+        version, limit = self.version(), self.repair_limit()
+        self.routes = {d: route for d, route in self.routes.items() if version - route.version <= limit}
+        oldest = min((route.version for route in self.routes.values()), default=version)
+        del self.road_log[:oldest - self.log_start]
+        self.log_start = oldest
 
     def portrayal_method(self):
         portrayals = []
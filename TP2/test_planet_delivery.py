@@ -0,0 +1,24 @@
+import math
+
+import networkx as nx
+import pytest
+
+from planet_delivery import PlanetDelivery
+
+STEPS = 100
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_repaired_routes_match_dijkstra(seed):
+    # Après chaque step, chaque arbre de routage réparé doit donner les temps de parcours d'un Dijkstra complet
+    model = PlanetDelivery(15, 30, 0.5, seed=seed, headless=True)
+    environment = model.schedule.agents[0]
+    for _ in range(STEPS):
+        model.step()
+        for destination, route in list(environment.routes.items()):
+            environment.next_hop(destination, destination)
+            expected = nx.single_source_dijkstra_path_length(environment.current_graph, destination, weight='weight')
+            assert route.dist == {planet: d for planet, d in expected.items() if d < math.inf}
+            for planet, via in route.next_hops.items():
+                assert planet in route.children[via]
+                assert route.dist[planet] == pytest.approx(route.dist[via] + environment.adjacency[planet][via])
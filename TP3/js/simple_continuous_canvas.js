@@ -19,6 +19,23 @@ var ContinuousVisualization = function(height, width, context) {
 		};
 	};
 
+	// Format binaire : une couche = 9 colonnes float32 (x, y, x2, y2, taille, angle, couleur, forme, rempli)
+	this.drawColumns = function(buffer, n, palette) {
+		var col = function(k) { return new Float32Array(buffer, 4 * k * n, n); };
+		var x = col(0), y = col(1), x2 = col(2), y2 = col(3), size = col(4), angle = col(5);
+		var color = col(6), shape = col(7), filled = col(8);
+		for (var i = 0; i < n; i++) {
+			var c = palette[color[i]];
+			var fill = filled[i] ? "true" : "false";
+			if (shape[i] == 0)
+				this.drawCircle(x[i], y[i], size[i], c, fill);
+			else if (shape[i] == 1)
+				this.drawLine(x[i], y[i], x2[i], y2[i], size[i], c);
+			else
+				this.drawArrrowHead(x[i], y[i], angle[i], size[i], c, fill);
+		}
+	};
+
 	this.drawCircle = function(x, y, radius, color, fill) {
 		var cx = x * width;
 		var cy = y * height;
@@ -96,12 +113,50 @@ var Simple_Continuous_Module = function(canvas_width, canvas_height, ids) {
 	var context = canvas.getContext("2d");
 	var canvasDraw = new ContinuousVisualization(canvas_width, canvas_height, context);
 
+	// Scène côté client pour le rendu "delta" : portrayals indexés par clé, regroupés par couche au dessin
+	var scene = {};
+
+	var applyDelta = function(data) {
+		if (data.full)
+			scene = {};
+		for (var key in data.set)
+			scene[key] = data.set[key];
+		for (var i = 0; i < data.del.length; i++)
+			delete scene[data.del[i]];
+		var layers = {};
+		for (var key in scene) {
+			var p = scene[key];
+			if (!(p.Layer in layers))
+				layers[p.Layer] = [];
+			layers[p.Layer].push(p);
+		}
+		return layers;
+	};
+
+	var decodeBase64 = function(text) {
+		var raw = atob(text);
+		var bytes = new Uint8Array(raw.length);
+		for (var i = 0; i < raw.length; i++)
+			bytes[i] = raw.charCodeAt(i);
+		return bytes.buffer;
+	};
+
 	this.render = function(data) {
 		canvasDraw.resetCanvas();
+		if (data.binary) {
+			for (var layer in data.layers) {
+				var block = data.layers[layer];
+				canvasDraw.drawColumns(decodeBase64(block.data), block.n, data.palette);
+			}
+			return;
+		}
+		if (data.delta)
+			data = applyDelta(data);
 		canvasDraw.draw(data);
 	};
 
 	this.reset = function() {
+		scene = {};
 		canvasDraw.resetCanvas();
 	};
 
@@ -1,12 +1,15 @@
+import array
+import base64
 import enum
 import math
+import os
 import random
-import uuid
 from enum import Enum
 
 import mesa
 import numpy as np
-from collections import defaultdict
+import pandas as pd
+from collections import defaultdict, deque
 
 import mesa.space
 from mesa import Agent, Model
@@ -15,17 +18,25 @@ from mesa.time import RandomActivation
 from mesa.visualization.ModularVisualization import VisualizationElement, ModularServer, UserSettableParameter
 from mesa.visualization.modules import ChartModule
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow n'est nécessaire que pour ColumnarDataCollector
+    pa = pq = None
+
 MAX_ITERATION = 100
 PROBA_CHGT_ANGLE = 0.01
+# Codes de forme du format binaire du canvas (doivent correspondre à simple_continuous_canvas.js)
+SHAPES = {"circle": 0, "line": 1, "arrowHead": 2}
 
 
 def move(x, y, speed, angle):
     return x + speed * math.cos(angle), y + speed * math.sin(angle)
 
 
-def go_to(x, y, speed, dest_x, dest_y):
+def go_to(x, y, speed, dest_x, dest_y, rng=random):
     if np.linalg.norm((x - dest_x, y - dest_y)) < speed:
-        return (dest_x, dest_y), 2 * math.pi * random.random()
+        return (dest_x, dest_y), 2 * math.pi * rng.random()
     else:
         angle = math.acos((dest_x - x)/np.linalg.norm((x - dest_x, y - dest_y)))
         if dest_y < y:
@@ -33,11 +44,194 @@ def go_to(x, y, speed, dest_x, dest_y):
         return move(x, y, speed, angle), angle
 
 
+def cosine_arc(center, k):
+    # Arc des directions θ telles que cos(θ - center) > k : (centre, demi-largeur), demi-largeur π si toutes les
+    # directions y sont, None si aucune
+    if k >= 1:
+        return None
+    return center, (math.acos(k) if k > -1 else math.pi)
+
+
+def blocked_arc(dx, dy, step, radius):
+    # Directions dans lesquelles un pas de longueur step finit dans le disque de rayon radius centré en (dx, dy) :
+    # |step.u(θ) - c|² < radius²  <=>  cos(θ - φ) > (step² + d² - radius²) / (2.step.d)
+    d = math.hypot(dx, dy)
+    if d == 0:
+        return (0.0, math.pi) if step < radius else None
+    return cosine_arc(math.atan2(dy, dx), (step * step + d * d - radius * radius) / (2 * step * d))
+
+
+def free_angle(arcs, rng=random):
+    # Angle tiré uniformément hors des arcs bloqués (un seul tirage), None si toutes les directions sont bloquées
+    intervals = []
+    for center, half_width in arcs:
+        if half_width >= math.pi:
+            return None
+        start = (center - half_width) % (2 * math.pi)
+        end = start + 2 * half_width
+        if end > 2 * math.pi:
+            intervals += [(start, 2 * math.pi), (0.0, end - 2 * math.pi)]
+        else:
+            intervals.append((start, end))
+    gaps = []
+    position = 0.0
+    for start, end in sorted(intervals):
+        if start > position:
+            gaps.append((position, start))
+        position = max(position, end)
+    if position < 2 * math.pi:
+        gaps.append((position, 2 * math.pi))
+    total = sum(end - start for start, end in gaps)
+    if total <= 0:
+        return None
+    u = rng.random() * total
+    for start, end in gaps:
+        if u < end - start:
+            return start + u
+        u -= end - start
+    return gaps[-1][1]
+
+
+def pairs_within(sources, targets, radius):
+    # Tous les couples (i, j) tels que |sources[i] - targets[j]| < radius, via un tri des cibles par cellule de côté radius
+    empty = np.empty(0, dtype=np.intp)
+    if len(sources) == 0 or len(targets) == 0:
+        return empty, empty
+    # cellules comptées depuis le coin commun : les points visés hors zone (coordonnées négatives) restent valides
+    origin = np.minimum(sources.min(axis=0), targets.min(axis=0))
+    source_cells = np.floor((sources - origin) / radius).astype(np.int64) + 1
+    target_cells = np.floor((targets - origin) / radius).astype(np.int64) + 1
+    width = int(max(source_cells[:, 1].max(), target_cells[:, 1].max())) + 2
+    target_ids = target_cells[:, 0] * width + target_cells[:, 1]
+    order = np.argsort(target_ids, kind="stable")
+    sorted_ids = target_ids[order]
+    found_i, found_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            ids = (source_cells[:, 0] + dx) * width + source_cells[:, 1] + dy
+            start = np.searchsorted(sorted_ids, ids, "left")
+            counts = np.searchsorted(sorted_ids, ids, "right") - start
+            total = counts.sum()
+            if total == 0:
+                continue
+            offsets = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(total)
+            found_i.append(np.repeat(np.arange(len(sources)), counts))
+            found_j.append(order[offsets])
+    if not found_i:
+        return empty, empty
+    i, j = np.concatenate(found_i), np.concatenate(found_j)
+    keep = ((sources[i] - targets[j]) ** 2).sum(axis=1) < radius * radius
+    return i[keep], j[keep]
+
+
+def nearest_within(sources, targets, radius):
+    # Pour chaque source qui a une cible à moins de radius : (source, cible la plus proche, distance)
+    i, j = pairs_within(sources, targets, radius)
+    distance = np.hypot(targets[j, 0] - sources[i, 0], targets[j, 1] - sources[i, 1])
+    order = np.lexsort((distance, i))
+    i, j, distance = i[order], j[order], distance[order]
+    first = np.flatnonzero(np.r_[True, i[1:] != i[:-1]]) if len(i) else np.empty(0, dtype=np.intp)
+    return i[first], j[first], distance[first]
+
+
 class MarkerPurpose(Enum):
     DANGER = enum.auto(),
     INDICATION = enum.auto()
 
 
+class ColumnarDataCollector:
+    # Variante de mesa.DataCollector pour les longues séries : les valeurs des reporters sont tamponnées dans des
+    # tableaux typés puis écrites par blocs, la mémoire reste constante pendant le run. Chaque bloc est un fichier
+    # Parquet complet (path.part0, path.part1, ...), lisible en cours de run ; close() les réunit dans path
+    def __init__(self, model_reporters, path, chunk_size=1024):
+        if pq is None:
+            raise ImportError("ColumnarDataCollector requires pyarrow")
+        self.model_reporters = model_reporters
+        self.path = path
+        self.chunk_size = chunk_size
+        self.schema = pa.schema([("Step", pa.int64())] + [(label, pa.float64()) for label in model_reporters])
+        self.model_vars = {label: deque(maxlen=1) for label in model_reporters}  # dernière valeur, lue par ChartModule
+        self.parts = []
+        self.closed = False
+        self.n_rows = 0
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.steps = array.array("q")
+        self.buffers = {label: array.array("d") for label in self.model_reporters}
+
+    def _buffer_table(self):
+        columns = [pa.array(np.frombuffer(self.steps, dtype=np.int64))]
+        columns += [pa.array(np.frombuffer(self.buffers[label], dtype=np.float64)) for label in self.model_reporters]
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def collect(self, model):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        self.steps.append(self.n_rows)
+        for label, reporter in self.model_reporters.items():
+            value = reporter(model)
+            self.buffers[label].append(value)
+            self.model_vars[label].append(value)
+        self.n_rows += 1
+        if len(self.steps) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.closed:
+            raise ValueError("ColumnarDataCollector is closed")
+        if not self.steps:
+            return
+        part = "{}.part{}".format(self.path, len(self.parts))
+        pq.write_table(self._buffer_table(), part)
+        self.parts.append(part)
+        self._reset_buffers()
+
+    def close(self):
+        # réunit les blocs écrits et le tampon dans path, bloc par bloc, puis supprime les blocs
+        if self.closed:
+            return
+        with pq.ParquetWriter(self.path, self.schema) as writer:
+            for part in self.parts:
+                writer.write_table(pq.read_table(part))
+            writer.write_table(self._buffer_table())
+        for part in self.parts:
+            os.remove(part)
+        self.parts = []
+        self._reset_buffers()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_model_vars_dataframe(self):
+        # en cours de run : blocs déjà écrits et tampon, sans fermer le collecteur
+        if self.closed:
+            table = pq.read_table(self.path)
+        else:
+            table = pa.concat_tables([pq.read_table(part) for part in self.parts] + [self._buffer_table()])
+        return table.to_pandas().set_index("Step")
+
+
+def run_model(model, max_steps=None, stop=None):
+    # Boucle serrée (batch, CI) : jusqu'à la fin du modèle, au budget de pas ou quand stop(model) est vrai.
+    # Le fichier du ColumnarDataCollector est fermé en sortie, même si le modèle n'a pas atteint sa fin
+    steps = 0
+    try:
+        while model.running and (max_steps is None or steps < max_steps):
+            model.step()
+            steps += 1
+            if stop is not None and stop(model):
+                break
+    finally:
+        if isinstance(model.datacollector, ColumnarDataCollector):
+            model.datacollector.close()
+    return steps
+
+
 class ContinuousCanvas(VisualizationElement):
     local_includes = [
         "./js/simple_continuous_canvas.js",
@@ -45,11 +239,18 @@ class ContinuousCanvas(VisualizationElement):
     ]
 
     def __init__(self, canvas_height=500,
-                 canvas_width=500, instantiate=True):
+                 canvas_width=500, instantiate=True, render_mode="full", keyframe_interval=0):
         VisualizationElement.__init__(self)
         self.canvas_height = canvas_height
         self.canvas_width = canvas_width
         self.identifier = "space-canvas"
+        # "full" : toute la scène à chaque image, "delta" : seulement les changements, "binary" : colonnes float32
+        self.render_mode = render_mode
+        self.keyframe_interval = keyframe_interval
+        self._model = None
+        self._frame = 0
+        self._scene = dict()
+        self._static = dict()
         if (instantiate):
             new_element = ("new Simple_Continuous_Module({}, {},'{}')".
                            format(self.canvas_width, self.canvas_height, self.identifier))
@@ -58,50 +259,163 @@ class ContinuousCanvas(VisualizationElement):
     def portrayal_method(self, obj):
         return obj.portrayal_method()
 
+    def portrayals(self, model, static=True):
+        collections = [(model.schedule.agents, False), (model.mines, False), (model.markers, False)]
+        if static:
+            collections += [(model.obstacles, True), (model.quicksands, True)]
+        for collection, is_static in collections:
+            for obj in collection:
+                portrayal = self.portrayal_method(obj)
+                if portrayal:
+                    portrayal["x"] = ((obj.x - model.space.x_min) /
+                                      (model.space.x_max - model.space.x_min))
+                    portrayal["y"] = ((obj.y - model.space.y_min) /
+                                      (model.space.y_max - model.space.y_min))
+                    yield str(id(obj)), portrayal, is_static
+
     def render(self, model):
+        if model.headless:
+            return dict()
+        if self.render_mode == "delta":
+            return self.render_delta(model)
+        if self.render_mode == "binary":
+            return self.render_binary(model)
         representation = defaultdict(list)
-        for obj in model.schedule.agents:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.mines:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.markers:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.obstacles:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.quicksands:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
+        for _, portrayal, _ in self.portrayals(model):
             representation[portrayal["Layer"]].append(portrayal)
         return representation
 
+    def render_delta(self, model):
+        # Image complète au premier rendu d'un modèle (et toutes les keyframe_interval images), sinon seulement les
+        # portrayals ajoutés, modifiés ou supprimés depuis l'image précédente ; le décor statique n'est envoyé qu'une fois
+        if model is not self._model:
+            self._model = model
+            self._frame = 0
+        full = self._frame == 0 or (self.keyframe_interval > 0 and self._frame % self.keyframe_interval == 0)
+        if full:
+            self._static = dict()
+        scene = dict(self._static)
+        changed = dict()
+        for key, portrayal, is_static in self.portrayals(model, static=full):
+            scene[key] = portrayal
+            if is_static:
+                self._static[key] = portrayal
+            if full or self._scene.get(key) != portrayal:
+                changed[key] = portrayal
+        removed = [] if full else [key for key in self._scene if key not in scene]
+        self._scene = scene
+        self._frame += 1
+        return {"delta": True, "full": full, "set": changed, "del": removed}
+
+    def render_binary(self, model):
+        # Une couche = un bloc float32 rangé colonne par colonne (x, y, x2, y2, taille, angle, couleur, forme, rempli),
+        # transmis en base64 dans le message JSON de mesa ; le client le relit avec des vues Float32Array
+        palette = dict()
+        layers = defaultdict(list)
+        for _, p, _ in self.portrayals(model):
+            color = palette.setdefault(p["Color"], len(palette))
+            filled = p.get("Filled") == "true"
+            if p["Shape"] == "line":
+                row = (p["from_x"], p["from_y"], p["to_x"], p["to_y"], p["width"], 0, color, SHAPES["line"], filled)
+            elif p["Shape"] == "arrowHead":
+                row = (p["x"], p["y"], 0, 0, p["s"], p["angle"], color, SHAPES["arrowHead"], filled)
+            else:
+                row = (p["x"], p["y"], 0, 0, p["r"], 0, color, SHAPES["circle"], filled)
+            layers[p["Layer"]].append(row)
+        blocks = dict()
+        for layer, rows in layers.items():
+            columns = np.array(rows, dtype="<f4").T.copy()
+            blocks[layer] = {"n": len(rows), "data": base64.b64encode(columns.tobytes()).decode("ascii")}
+        return {"binary": True, "palette": list(palette), "layers": blocks}
+
+
+class CircleGrid:
+    # Index statique de cercles (obstacles, sables mouvants), construit une fois : chaque cercle est rangé dans les
+    # cases couvertes par sa boîte englobante, une requête ne teste que les cercles des cases autour du point
+    def __init__(self, circles, cell_size=None):
+        self.circles = list(circles)
+        self.cell_size = cell_size or 2 * max((c.r for c in self.circles), default=1.0)
+        self.cells = defaultdict(list)  # (i, j) -> indices croissants des cercles qui recouvrent la case
+        for k, c in enumerate(self.circles):
+            for cell in self.cells_between(c.x - c.r, c.y - c.r, c.x + c.r, c.y + c.r):
+                self.cells[cell].append(k)
+
+    def cells_between(self, x_min, y_min, x_max, y_max):
+        s = self.cell_size
+        return [(i, j) for i in range(math.floor(x_min / s), math.floor(x_max / s) + 1)
+                for j in range(math.floor(y_min / s), math.floor(y_max / s) + 1)]
+
+    def containing(self, x, y):
+        # cercles qui contiennent (x, y), dans l'ordre d'insertion
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        return [self.circles[k] for k in self.cells.get(cell, ())
+                if math.hypot(x - self.circles[k].x, y - self.circles[k].y) < self.circles[k].r]
+
+    def near(self, x, y, distance):
+        # cercles dont le bord est à moins de distance de (x, y), dans l'ordre d'insertion
+        found = set()
+        for cell in self.cells_between(x - distance, y - distance, x + distance, y + distance):
+            found.update(self.cells.get(cell, ()))
+        return [self.circles[k] for k in sorted(found)
+                if math.hypot(x - self.circles[k].x, y - self.circles[k].y) < distance + self.circles[k].r]
+
+
+class BucketGrid:
+    # Index dynamique de points (mines, balises, robots) : une case par (catégorie, i, j), ajout et retrait en O(1), une requête
+    # de rayon r ne parcourt que les cases voisines de la catégorie demandée
+    def __init__(self, cell_size, kind=lambda item: None):
+        self.cell_size = cell_size
+        self.kind = kind  # catégorie d'un élément (ex. but d'une balise), fixée à l'ajout
+        self.cells = defaultdict(dict)  # dict utilisé comme ensemble ordonné (retrait en O(1))
+        self.item_cells = dict()  # élément -> case, aussi ordre d'insertion pour l'itération
+        self.counts = defaultdict(int)
+
+    def cell(self, kind, x, y):
+        return kind, math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, item):
+        kind = self.kind(item)
+        key = self.cell(kind, item.x, item.y)
+        self.cells[key][item] = None
+        self.item_cells[item] = key
+        self.counts[kind] += 1
+
+    def remove(self, item):
+        key = self.item_cells.pop(item)
+        del self.cells[key][item]
+        self.counts[key[0]] -= 1
+
+    def move(self, item):
+        # à appeler après chaque changement de item.x, item.y
+        key = self.cell(self.kind(item), item.x, item.y)
+        old_key = self.item_cells[item]
+        if key != old_key:
+            del self.cells[old_key][item]
+            self.cells[key][item] = None
+            self.item_cells[item] = key
+
+    def count(self, kind=None):
+        return self.counts[kind]
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def __iter__(self):
+        return iter(self.item_cells)
+
+    def within(self, x, y, radius, kind=None):
+        # [élément, distance] à moins de radius de (x, y), du plus proche au plus lointain
+        _, ci, cj = self.cell(kind, x, y)
+        reach = math.ceil(radius / self.cell_size)
+        found = []
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach, cj + reach + 1):
+                for item in self.cells.get((kind, i, j), ()):
+                    distance = math.hypot(x - item.x, y - item.y)
+                    if distance < radius:
+                        found.append([item, distance])
+        return sorted(found, key=lambda found_item: found_item[1])
+
 
 class Obstacle:  # Environnement: obstacle infranchissable
     def __init__(self, x, y, r):
@@ -183,59 +497,50 @@ class Robot(Agent):  # La classe des agents
 
 
     def detect_markers(self, purpose):
-        detected_markers = []
-        for marker in self.model.markers:
-            if ((math.sqrt((self.x-marker.x)**2 + (self.y-marker.y)**2) < self.sight_distance) and (marker.purpose == purpose)):
-                detected_markers.append([marker, math.sqrt((self.x-marker.x)**2 + (self.y-marker.y)**2)])
-        return sorted(detected_markers, key = lambda x : x[1])
+        return self.model.markers.within(self.x, self.y, self.sight_distance, purpose)
 
 
     def detect_quicksand(self):
-        for quicksand in self.model.quicksands:
-            if (math.sqrt((self.x-quicksand.x)**2 + (self.y-quicksand.y)**2) < quicksand.r):
-                if self.isInQuicksand == False:
-                    self.isInQuicksand = True
-                    self.speed = self.speed / 2
-                self.model.nb_quicksands +=1
-                return True
+        if self.model.quicksand_index.containing(self.x, self.y):
+            if self.isInQuicksand == False:
+                self.isInQuicksand = True
+                self.speed = self.speed / 2
+            self.model.nb_quicksands +=1
+            return True
         self.isInQuicksand = False
         return False
 
     def detect_obstacles(self, nextX, nextY):
       ##on considèrera qu'un robot 'peut' traverser un obstacle : si l'obstacle est entre le point de départ et le point d'arrivée du robot, il le traversera
-      in_range_obstacles = [obstacle for obstacle in self.model.obstacles if math.sqrt((self.x - obstacle.x)**2 + (self.y - obstacle.y)**2) < self.sight_distance+obstacle.r ]
-      collision_obstacles = []
-      for obstacle in in_range_obstacles :
-      #for obstacle in self.model.obstacles:
-        if (math.sqrt((nextX-obstacle.x)**2 + (nextY-obstacle.y)**2) < obstacle.r):
-          collision_obstacles.append(obstacle)
-      return collision_obstacles
+      ##le point visé est à moins de speed < sight_distance du robot : tout obstacle qui le contient est dans le champ de vision
+      return self.model.obstacle_index.containing(nextX, nextY)
     
     def detect_robots(self, nextX, nextY):
-      in_range_robots = [robot for robot in self.model.schedule.agents if math.sqrt((self.x - robot.x)**2+(self.y - robot.y)**2) < self.sight_distance]
-
-      collision_robots = []
-
-      for robot in in_range_robots:
-        if ((math.sqrt((nextX - robot.x)**2+(nextY - robot.y)**2) < robot.speed)):
-          collision_robots.append(robot)
-      return collision_robots
+      ##un robot ne va jamais plus vite que model.speed : les candidats sont dans les cases autour du point visé,
+      ##et tous dans le champ de vision (speed + speed <= sight_distance)
+      return [robot for robot, distance in self.model.robots.within(nextX, nextY, self.model.speed)
+              if distance < robot.speed]
 
     def detect_bord(self, nextX, nextY):
       return self.model.space.out_of_bounds([nextX,nextY])
+
+    def blocked_arcs(self):
+      ##directions dans lesquelles un pas de self.speed mène dans un obstacle, trop près d'un robot ou hors de la zone
+      step = self.speed
+      arcs = [blocked_arc(obstacle.x - self.x, obstacle.y - self.y, step, obstacle.r)
+              for obstacle in self.model.obstacle_index.near(self.x, self.y, step)]
+      arcs += [blocked_arc(robot.x - self.x, robot.y - self.y, step, robot.speed)
+               for robot, _ in self.model.robots.within(self.x, self.y, step + self.model.speed)]
+      space = self.model.space
+      arcs += [cosine_arc(math.pi, (self.x - space.x_min) / step), cosine_arc(0.0, (space.x_max - self.x) / step),
+               cosine_arc(3 * math.pi / 2, (self.y - space.y_min) / step),
+               cosine_arc(math.pi / 2, (space.y_max - self.y) / step)]
+      return [arc for arc in arcs if arc is not None]
     
     def detect_mines(self):
-      in_range_mines = [[mine, math.sqrt((self.x - mine.x)**2 + (self.y - mine.y)**2)] for mine in self.model.mines if math.sqrt((self.x - mine.x)**2 + (self.y - mine.y)**2) < self.sight_distance]
-      
+      in_range_mines = self.model.mines.within(self.x, self.y, self.sight_distance)
       if (len(in_range_mines) > 0):
-        idxMine = 0
-        minDist = math.inf
-        for i in range(len(in_range_mines)):
-          if in_range_mines[i][1] < minDist:
-            idxMine = i
-            minDist = in_range_mines[i][1]
-
-        return [in_range_mines[idxMine][0], in_range_mines[idxMine][1]]
+        return in_range_mines[0]
       return []
 
     def step(self):
@@ -250,7 +555,7 @@ class Robot(Agent):  # La classe des agents
         self.detect_quicksand()
         if temp_quicksand == True and self.isInQuicksand == False:
             self.speed *= 2
-            self.model.markers.append(Marker(self.x, self.y, MarkerPurpose.DANGER, direction=None))
+            self.model.markers.add(Marker(self.x, self.y, MarkerPurpose.DANGER, direction=None))
             self.counter = int(self.speed / 2)
         
         #### mise à jour du compteur ####
@@ -259,30 +564,25 @@ class Robot(Agent):  # La classe des agents
         
         #### se déplacer : placé au début, le mouvement sera remplacé si une étape plus importante est réalisée ####
         ##calcul d'un nouvel angle de déplacement si aucun obstacle/robot/mine n'est détecté
-        p = random.random()
+        p = self.random.random()
         if (p < PROBA_CHGT_ANGLE):
-            self.angle = random.uniform(0, 2*math.pi)
+            self.angle = self.random.uniform(0, 2*math.pi)
 
         ###### calcul de l'emplacement potentiel au prochain tour ######
         nextX, nextY = move(self.x, self.y, self.speed, self.angle)
 
 
         #### Niveau 0 : contraintes de déplacement ####
-        isCollidingRobots = True
-        isCollidingObstacles = True
-        isCollidingBord = True
-        while isCollidingRobots or isCollidingObstacles or isCollidingBord :
-          ##détection et évitement des autres robots
-          collision_robots = self.detect_robots(nextX, nextY)
-          isCollidingRobots = (len(collision_robots) != 0)
-          ##détection et évitement des obstacles
-          collision_obstacles = self.detect_obstacles(nextX, nextY)
-          isCollidingObstacles = (len(collision_obstacles) != 0)
-          ##détection des bors de la zone
-          isCollidingBord = self.detect_bord(nextX, nextY)
-          if isCollidingRobots or isCollidingObstacles or isCollidingBord :
-            self.angle = random.random() * 2 * math.pi
-            nextX, nextY = move(self.x, self.y, self.speed, self.angle)
+        ##si la direction courante mène à une collision (robot, obstacle ou bord), on tire directement une direction
+        ##uniforme parmi les directions libres, comme le ferait un nouveau tirage répété jusqu'au succès, mais en une
+        ##seule fois ; s'il n'y en a aucune, le robot reste sur place
+        isBlocked = False
+        if self.detect_robots(nextX, nextY) or self.detect_obstacles(nextX, nextY) or self.detect_bord(nextX, nextY):
+          angle = free_angle(self.blocked_arcs(), self.random)
+          if angle is None:
+            isBlocked = True
+          else:
+            self.angle = angle
 
         
         ## Niveau 1 : détection des mines et déminage 
@@ -292,10 +592,10 @@ class Robot(Agent):  # La classe des agents
           if mineAimed[1] == 0:
             self.model.disarmed_mines += 1
             self.model.mines.remove(mineAimed[0])
-            self.model.markers.append(Marker(self.x, self.y, MarkerPurpose.INDICATION, direction=self.angle))
+            self.model.markers.add(Marker(self.x, self.y, MarkerPurpose.INDICATION, direction=self.angle))
             self.counter = int(self.speed / 2)
           else :
-            (self.x, self.y), self.angle = go_to(self.x, self.y, self.speed, mineAimed[0].x, mineAimed[0].y)
+            (self.x, self.y), self.angle = go_to(self.x, self.y, self.speed, mineAimed[0].x, mineAimed[0].y, self.random)
             self.isMoving = True
         
         
@@ -314,15 +614,16 @@ class Robot(Agent):  # La classe des agents
                         self.model.markers.remove(indication[0])
 
                     else :
-                        (self.x, self.y), self.angle = go_to(self.x, self.y, self.speed, indication[0].x, indication[0].y)
+                        (self.x, self.y), self.angle = go_to(self.x, self.y, self.speed, indication[0].x, indication[0].y, self.random)
                         self.isMoving = True
         
 
 
         ##déplacement de base
 
-        if not self.isMoving:
+        if not self.isMoving and not isBlocked:
           self.x, self.y = move(self.x, self.y, self.speed, self.angle)
+        self.model.robots.move(self)
 
         self.isMoving = False
           
@@ -334,47 +635,56 @@ class Robot(Agent):  # La classe des agents
 
 
 class MinedZone(Model):
-    collector = DataCollector(
-        model_reporters={"Mines": lambda model: len(model.mines),
-                         "Danger markers": lambda model: len([m for m in model.markers if
-                                                          m.purpose == MarkerPurpose.DANGER]),
-                         "Indication markers": lambda model: len([m for m in model.markers if
-                                                          m.purpose == MarkerPurpose.INDICATION]),
-                         "Mines désamorcées": lambda model: model.disarmed_mines,
-                         "#tours moyen dans les quicksands": lambda model: model.nb_quicksands / model.n_robots
-                         },
-        agent_reporters={})
-
-    def __init__(self, n_robots, n_obstacles, n_quicksand, n_mines, speed):
+    model_reporters = {"Mines": lambda model: len(model.mines),
+                       "Danger markers": lambda model: model.markers.count(MarkerPurpose.DANGER),
+                       "Indication markers": lambda model: model.markers.count(MarkerPurpose.INDICATION),
+                       "Mines désamorcées": lambda model: model.disarmed_mines,
+                       "#tours moyen dans les quicksands": lambda model: model.nb_quicksands / model.n_robots
+                       }
+
+    def __init__(self, n_robots, n_obstacles, n_quicksand, n_mines, speed, seed=None, collector_path=None,
+                 headless=False):
         Model.__init__(self)
+        self.seed = seed
+        self.headless = headless  # aucun portrayal, aucun affichage : pour les runs batch et benchmarks
+        self.random = random.Random(seed)  # flux aléatoire propre au modèle (aussi utilisé par RandomActivation)
         self.space = mesa.space.ContinuousSpace(600, 600, False)
         self.schedule = RandomActivation(self)
-        self.mines = []  # Access list of mines from robot through self.model.mines
-        self.markers = []  # Access list of markers from robot through self.model.markers (both read and write)
+        # mines et balises indexées par cases de la taille du champ de vision : une détection parcourt 3 x 3 cases
+        self.mines = BucketGrid(2 * speed)  # Access mines from robot through self.model.mines
+        # Access markers from robot through self.model.markers (both read and write), filtered by purpose
+        self.markers = BucketGrid(2 * speed, kind=lambda marker: marker.purpose)
         self.obstacles = []  # Access list of obstacles from robot through self.model.obstacles
         self.quicksands = []  # Access list of quicksands from robot through self.model.quicksands
         self.disarmed_mines = 0
         self.nb_quicksands = 0
         self.n_robots = n_robots
+        self.speed = speed
+        self.robots = BucketGrid(2 * speed)  # positions des robots, tenues à jour à la fin de chaque Robot.step
         for _ in range(n_obstacles):
-            self.obstacles.append(Obstacle(random.random() * 500, random.random() * 500, 10 + 20 * random.random()))
+            self.obstacles.append(Obstacle(self.random.random() * 500, self.random.random() * 500, 10 + 20 * self.random.random()))
         for _ in range(n_quicksand):
-            self.quicksands.append(Quicksand(random.random() * 500, random.random() * 500, 10 + 20 * random.random()))
+            self.quicksands.append(Quicksand(self.random.random() * 500, self.random.random() * 500, 10 + 20 * self.random.random()))
+        # obstacles et sables mouvants ne bougent plus : index construits une fois pour toutes
+        self.obstacle_index = CircleGrid(self.obstacles)
+        self.quicksand_index = CircleGrid(self.quicksands)
         for _ in range(n_robots):
-            x, y = random.random() * 500, random.random() * 500
-            while [o for o in self.obstacles if np.linalg.norm((o.x - x, o.y - y)) < o.r] or \
-                    [o for o in self.quicksands if np.linalg.norm((o.x - x, o.y - y)) < o.r]:
-                x, y = random.random() * 500, random.random() * 500
-            self.schedule.add(
-                Robot(int(uuid.uuid1()), self, x, y, speed,
-                      2 * speed, random.random() * 2 * math.pi))
+            x, y = self.random.random() * 500, self.random.random() * 500
+            while self.obstacle_index.containing(x, y) or self.quicksand_index.containing(x, y):
+                x, y = self.random.random() * 500, self.random.random() * 500
+            robot = Robot(self.next_id(), self, x, y, speed, 2 * speed, self.random.random() * 2 * math.pi)
+            self.schedule.add(robot)
+            self.robots.add(robot)
         for _ in range(n_mines):
-            x, y = random.random() * 500, random.random() * 500
-            while [o for o in self.obstacles if np.linalg.norm((o.x - x, o.y - y)) < o.r] or \
-                    [o for o in self.quicksands if np.linalg.norm((o.x - x, o.y - y)) < o.r]:
-                x, y = random.random() * 500, random.random() * 500
-            self.mines.append(Mine(x, y))
-        self.datacollector = self.collector
+            x, y = self.random.random() * 500, self.random.random() * 500
+            while self.obstacle_index.containing(x, y) or self.quicksand_index.containing(x, y):
+                x, y = self.random.random() * 500, self.random.random() * 500
+            self.mines.add(Mine(x, y))
+        # un collecteur par instance : un collecteur partagé au niveau de la classe mélangeait les runs successifs
+        if collector_path is None:
+            self.datacollector = DataCollector(model_reporters=self.model_reporters, agent_reporters={})
+        else:
+            self.datacollector = ColumnarDataCollector(self.model_reporters, collector_path)
 
         self.running = True
 
@@ -383,6 +693,256 @@ class MinedZone(Model):
         self.schedule.step()
         if not self.mines:
             self.running = False
+            if isinstance(self.datacollector, ColumnarDataCollector):
+                self.datacollector.close()
+
+    def run(self, max_steps=None, stop=None):
+        return run_model(self, max_steps, stop)
+
+
+DANGER, INDICATION = 0, 1  # codes des buts de balise dans VectorizedMinedZone
+
+vectorizedModelReporters = {"Mines": lambda m: len(m.mine_pos),
+                            "Danger markers": lambda m: int(np.count_nonzero(m.marker_purpose == DANGER)),
+                            "Indication markers": lambda m: int(np.count_nonzero(m.marker_purpose == INDICATION)),
+                            "Mines désamorcées": lambda m: m.disarmed_mines,
+                            "#tours moyen dans les quicksands": lambda m: m.nb_quicksands / m.n_robots}
+
+
+class VectorizedMinedZone(Model):
+    # Même dynamique que MinedZone, mais les robots sont des lignes de tableaux NumPy mis à jour par lots. Les niveaux
+    # de la subsomption restent dans le même ordre (sables mouvants, collisions, mines, balises, déplacement de base)
+    # et chaque niveau est évalué pour tous les robots à la fois, sur l'état du début du niveau
+    def __init__(self, n_robots, n_obstacles, n_quicksand, n_mines, speed, seed=None, collector_path=None,
+                 headless=False):
+        Model.__init__(self)
+        self.seed = seed
+        self.headless = headless
+        self.space = mesa.space.ContinuousSpace(600, 600, False)
+        self.rng = np.random.default_rng(seed)
+        self.obstacle_pos = self.rng.random((n_obstacles, 2)) * 500
+        self.obstacle_r = 10 + 20 * self.rng.random(n_obstacles)
+        self.quicksand_pos = self.rng.random((n_quicksand, 2)) * 500
+        self.quicksand_r = 10 + 20 * self.rng.random(n_quicksand)
+        self.n_robots = n_robots
+        self.base_speed = speed
+        self.sight_distance = 2 * speed
+        self.pos = self.free_positions(n_robots)
+        self.speed = np.full(n_robots, float(speed))
+        self.angle = self.rng.random(n_robots) * 2 * math.pi
+        self.counter = np.zeros(n_robots, dtype=np.int64)
+        self.isInQuicksand = np.zeros(n_robots, dtype=bool)
+        self.mine_pos = self.free_positions(n_mines)
+        self.marker_pos = np.empty((0, 2))
+        self.marker_purpose = np.empty(0, dtype=np.int8)
+        self.marker_direction = np.empty(0)
+        self.disarmed_mines = 0
+        self.nb_quicksands = 0
+        self.steps = 0
+
+        if collector_path is None:
+            self.datacollector = DataCollector(model_reporters=vectorizedModelReporters)
+        else:
+            self.datacollector = ColumnarDataCollector(vectorizedModelReporters, collector_path)
+
+        self.running = True
+
+    def inside(self, points, centers, radii):
+        # masque des points contenus dans au moins un des disques
+        found = np.zeros(len(points), dtype=bool)
+        if len(centers) > 0:
+            i, j = pairs_within(points, centers, radii.max())
+            found[i[((points[i] - centers[j]) ** 2).sum(axis=1) < radii[j] ** 2]] = True
+        return found
+
+    def free_positions(self, n):
+        # positions tirées dans [0, 500]², retirées tant qu'elles tombent dans un obstacle ou un sable mouvant
+        points = self.rng.random((n, 2)) * 500
+        redraw = self.inside(points, self.obstacle_pos, self.obstacle_r) | \
+            self.inside(points, self.quicksand_pos, self.quicksand_r)
+        while redraw.any():
+            points[redraw] = self.rng.random((np.count_nonzero(redraw), 2)) * 500
+            redraw[redraw] = self.inside(points[redraw], self.obstacle_pos, self.obstacle_r) | \
+                self.inside(points[redraw], self.quicksand_pos, self.quicksand_r)
+        return points
+
+    def add_markers(self, positions, purpose, directions):
+        self.marker_pos = np.concatenate([self.marker_pos, positions])
+        self.marker_purpose = np.concatenate([self.marker_purpose, np.full(len(positions), purpose, dtype=np.int8)])
+        self.marker_direction = np.concatenate([self.marker_direction, directions])
+
+    def go_to(self, robots, targets):
+        # go_to pour tous les robots d'un coup : un pas vers la cible, ou sur la cible (et nouvel angle au hasard)
+        delta = targets - self.pos[robots]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        arrived = distance < self.speed[robots]
+        ratio = self.speed[robots] / np.where(arrived, 1.0, distance)
+        self.pos[robots] = np.where(arrived[:, None], targets, self.pos[robots] + delta * ratio[:, None])
+        self.angle[robots] = np.where(arrived, self.rng.random(len(robots)) * 2 * math.pi,
+                                      np.arctan2(delta[:, 1], delta[:, 0]))
+
+    def sense_quicksand(self):
+        inside = self.inside(self.pos, self.quicksand_pos, self.quicksand_r)
+        self.speed[inside & ~self.isInQuicksand] /= 2
+        self.nb_quicksands += int(np.count_nonzero(inside))
+        left = self.isInQuicksand & ~inside
+        self.speed[left] *= 2
+        self.add_markers(self.pos[left], DANGER, np.zeros(np.count_nonzero(left)))
+        self.counter[left] = (self.speed[left] / 2).astype(np.int64)
+        self.isInQuicksand = inside
+
+    def avoid_collisions(self):
+        # Niveau 0 : masque des robots qui n'ont aucune direction libre et restent sur place
+        step = np.stack([np.cos(self.angle), np.sin(self.angle)], axis=1) * self.speed[:, None]
+        target = self.pos + step
+        colliding = (target[:, 0] < self.space.x_min) | (target[:, 0] >= self.space.x_max) | \
+            (target[:, 1] < self.space.y_min) | (target[:, 1] >= self.space.y_max)
+        colliding |= self.inside(target, self.obstacle_pos, self.obstacle_r)
+        # un robot ne se gêne pas lui-même (son point visé est exactement à speed de lui, aux arrondis près)
+        i, j = pairs_within(target, self.pos, self.base_speed)
+        close = (i != j) & (((target[i] - self.pos[j]) ** 2).sum(axis=1) < self.speed[j] ** 2)
+        colliding[i[close]] = True
+        blocked = np.zeros(len(self.pos), dtype=bool)
+        robots = np.flatnonzero(colliding)
+        if len(robots) == 0:
+            return blocked
+        # arcs bloqués (blocked_arc, cosine_arc) pour tous les couples robot en collision x voisin proche à la fois
+        n = len(robots)
+        pos, speed = self.pos[robots], self.speed[robots]
+        k_o, o = pairs_within(pos, self.obstacle_pos, self.base_speed + self.obstacle_r.max(initial=0))
+        k_r, r = pairs_within(pos, self.pos, 2 * self.base_speed)
+        near = np.concatenate([k_o, k_r])
+        delta = np.concatenate([self.obstacle_pos[o], self.pos[r]]) - pos[near]
+        radius = np.concatenate([self.obstacle_r[o], self.speed[r]])
+        step = speed[near]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = (step * step + distance * distance - radius * radius) / (2 * step * distance)
+        # centre confondu avec le robot : tout est bloqué si le pas finit dans le disque, rien sinon
+        cosine = np.where(distance == 0, np.where(step < radius, -np.inf, np.inf), cosine)
+        owner = np.concatenate([near, np.tile(np.arange(n), 4)])
+        center = np.concatenate([np.arctan2(delta[:, 1], delta[:, 0]),
+                                 np.repeat([math.pi, 0.0, 3 * math.pi / 2, math.pi / 2], n)])
+        cosine = np.concatenate([cosine, (pos[:, 0] - self.space.x_min) / speed, (self.space.x_max - pos[:, 0]) / speed,
+                                 (pos[:, 1] - self.space.y_min) / speed, (self.space.y_max - pos[:, 1]) / speed])
+        arc = cosine < 1
+        owner, center, half_width = owner[arc], center[arc], np.arccos(np.maximum(cosine[arc], -1))
+        surrounded = np.zeros(n, dtype=bool)
+        surrounded[owner[half_width >= math.pi]] = True
+        # free_angle pour tous les robots : intervalles [début, fin) ramenés dans [0, 2π), triés par robot puis début
+        start = (center - half_width) % (2 * math.pi)
+        end = start + 2 * half_width
+        wrap = end > 2 * math.pi
+        owner = np.concatenate([owner, owner[wrap]])
+        start = np.concatenate([start, np.zeros(np.count_nonzero(wrap))])
+        end = np.concatenate([np.minimum(end, 2 * math.pi), end[wrap] - 2 * math.pi])
+        order = np.lexsort((start, owner))
+        owner, start, end = owner[order], start[order], end[order]
+        # couverture depuis 0 : maximum cumulé des fins par robot, calculé sur les rangs entiers des fins (décalés par
+        # robot pour ne pas déborder sur le suivant) afin de retrouver les fins exactes, sans arrondi
+        by_end = np.argsort(end, kind="stable")
+        rank = np.empty(len(end), dtype=np.int64)
+        rank[by_end] = np.arange(len(end))
+        shift = owner.astype(np.int64) * len(end)
+        covered = end[by_end[np.maximum.accumulate(rank + shift) - shift]]
+        # aucun arc restant (ex. seul voisin confondu avec le robot) : tableaux vides, tout le cercle est libre
+        change = owner[1:] != owner[:-1]
+        first = np.r_[True, change][:len(owner)]
+        last = np.r_[change, True][:len(owner)]
+        position = np.where(first, 0.0, np.r_[0.0, covered[:-1]])
+        final = np.zeros(n)
+        final[owner[last]] = covered[last]
+        # trous libres : avant chaque intervalle, puis après le dernier, dans l'ordre des angles pour chaque robot
+        gap_owner = np.concatenate([owner, np.arange(n)])
+        gap_start = np.concatenate([position, final])
+        gap_length = np.concatenate([np.maximum(start - position, 0.0), 2 * math.pi - final])
+        kept = np.flatnonzero(gap_length > 0)
+        order = kept[np.argsort(gap_owner[kept], kind="stable")]
+        gap_owner, gap_start, gap_length = gap_owner[order], gap_start[order], gap_length[order]
+        if len(gap_length) == 0:
+            blocked[robots] = True
+            return blocked
+        total = np.bincount(gap_owner, weights=gap_length, minlength=n)
+        # un seul tirage par robot, placé dans ses trous mis bout à bout
+        u = self.rng.random(n) * total
+        counts = np.bincount(gap_owner, minlength=n)
+        group_end = np.cumsum(counts)
+        cumulated = np.cumsum(gap_length)
+        before = np.r_[0.0, cumulated][group_end - counts]
+        gap = np.clip(np.searchsorted(cumulated, before + u, "right"), group_end - counts,
+                      np.maximum(group_end - 1, 0))
+        offset = before + u - (cumulated[gap] - gap_length[gap])
+        angle = gap_start[gap] + np.clip(offset, 0.0, gap_length[gap])
+        free = ~surrounded & (total > 0)
+        blocked[robots[~free]] = True
+        self.angle[robots[free]] = angle[free]
+        return blocked
+
+    def seek_mines(self, moving):
+        # Niveau 1 : désamorçage si le robot est sur la mine la plus proche, sinon pas vers elle
+        robots, mines, distance = nearest_within(self.pos, self.mine_pos, self.sight_distance)
+        on_mine = distance == 0
+        approaching, targets = robots[~on_mine], self.mine_pos[mines[~on_mine]]
+        disarming, disarmed = robots[on_mine], mines[on_mine]
+        if len(disarming) > 0:
+            # deux robots sur la même mine : un seul désamorçage, une seule balise (le premier robot)
+            disarmed, first = np.unique(disarmed, return_index=True)
+            self.disarmed_mines += len(disarmed)
+            self.add_markers(self.mine_pos[disarmed], INDICATION, self.angle[disarming[first]])
+            self.counter[disarming] = (self.speed[disarming] / 2).astype(np.int64)
+            self.mine_pos = np.delete(self.mine_pos, disarmed, axis=0)
+        if len(approaching) > 0:
+            self.go_to(approaching, targets)
+            moving[approaching] = True
+
+    def follow_markers(self, moving):
+        # Niveau 2 : demi-tour devant une balise danger, sinon suivi de l'indication la plus proche
+        candidates = np.flatnonzero((self.counter == 0) & ~moving)
+        if len(candidates) == 0 or len(self.marker_pos) == 0:
+            return
+        dangers = self.marker_purpose == DANGER
+        i, _ = pairs_within(self.pos[candidates], self.marker_pos[dangers], self.sight_distance)
+        danger = np.zeros(len(candidates), dtype=bool)
+        danger[i] = True
+        self.angle[candidates[danger]] += math.pi * 0.95
+        candidates = candidates[~danger]
+        indications = np.flatnonzero(~dangers)
+        robots, markers, distance = nearest_within(self.pos[candidates], self.marker_pos[indications],
+                                                   self.sight_distance)
+        robots, markers = candidates[robots], indications[markers]
+        on_marker = distance == 0
+        self.angle[robots[on_marker]] = self.marker_direction[markers[on_marker]] + math.pi / 2
+        approaching = robots[~on_marker]
+        if len(approaching) > 0:
+            self.go_to(approaching, self.marker_pos[markers[~on_marker]])
+            moving[approaching] = True
+        picked = np.unique(markers[on_marker])
+        if len(picked) > 0:
+            self.marker_pos = np.delete(self.marker_pos, picked, axis=0)
+            self.marker_purpose = np.delete(self.marker_purpose, picked)
+            self.marker_direction = np.delete(self.marker_direction, picked)
+
+    def step(self):
+        self.datacollector.collect(self)
+        self.sense_quicksand()
+        self.counter[self.counter > 0] -= 1
+        change = self.rng.random(len(self.pos)) < PROBA_CHGT_ANGLE
+        self.angle[change] = self.rng.random(np.count_nonzero(change)) * 2 * math.pi
+        blocked = self.avoid_collisions()
+        moving = np.zeros(len(self.pos), dtype=bool)
+        self.seek_mines(moving)
+        self.follow_markers(moving)
+        free = ~moving & ~blocked
+        self.pos[free, 0] += self.speed[free] * np.cos(self.angle[free])
+        self.pos[free, 1] += self.speed[free] * np.sin(self.angle[free])
+        self.steps += 1
+        if len(self.mine_pos) == 0:
+            self.running = False
+            if isinstance(self.datacollector, ColumnarDataCollector):
+                self.datacollector.close()
+
+    def run(self, max_steps=None, stop=None):
+        return run_model(self, max_steps, stop)
 
 
 def run_single_server():
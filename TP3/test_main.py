@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from main import MinedZone, VectorizedMinedZone
+
+SEEDS = 30
+STEPS = 40
+
+
+def final_reporters(model_cls, params, seed):
+    model = model_cls(*params, seed=seed, headless=True)
+    model.run(STEPS)
+    return [values[-1] for values in model.datacollector.model_vars.values()]
+
+
+@pytest.mark.parametrize("n_robots", [7, 30])
+def test_vectorized_mined_zone_runs(n_robots):
+    # Robots confondus (deux go_to vers la même mine) : le niveau 0 ne doit jamais planter
+    for seed in range(SEEDS):
+        model = VectorizedMinedZone(n_robots, 5, 5, 30, 15, seed=seed, headless=True)
+        model.run(150)
+        assert np.isfinite(model.pos).all() and np.isfinite(model.angle).all()
+
+
+@pytest.mark.parametrize("params", [(7, 5, 5, 15, 15), (30, 5, 5, 30, 15)])
+def test_vectorized_mined_zone_matches_mined_zone(params):
+    # Les deux moteurs doivent donner les mêmes moyennes de reporters (test z sur SEEDS graines indépendantes)
+    reference = np.array([final_reporters(MinedZone, params, seed) for seed in range(SEEDS)], dtype=float)
+    vectorized = np.array([final_reporters(VectorizedMinedZone, params, seed) for seed in range(SEEDS)], dtype=float)
+    error = np.sqrt((reference.var(axis=0, ddof=1) + vectorized.var(axis=0, ddof=1)) / SEEDS) + 1e-9
+    z = np.abs(reference.mean(axis=0) - vectorized.mean(axis=0)) / error
+    assert (z < 4).all(), z
@@ -0,0 +1,262 @@
+# Benchmarks de passage à l'échelle des trois simulations (TP1 village, TP2 livraison spatiale, TP3 déminage).
+#
+# Pour chaque taille de population : temps de construction, pas/seconde sur un run sans instrumentation,
+# temps par phase (méthodes step des agents et collecte de données, temps inclusifs) et pic mémoire (tracemalloc).
+# Chaque taille tourne dans un processus à part, avec un budget de temps (--budget) : une taille trop lente ou tuée
+# faute de mémoire est notée "skipped" dans le JSON, ainsi que les tailles suivantes de la même suite.
+# Les résultats sont écrits en JSON avec le commit courant, pour comparer deux commits :
+#
+#     python benchmarks/bench_scaling.py --quick --output before.json
+#     python benchmarks/bench_scaling.py --quick --output after.json --compare before.json
+import argparse
+import contextlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VILLAGE_SIZES = [10, 100, 1000, 10000, 100000]
+PLANET_SIZES = [3, 10, 50, 100, 500]
+ROBOT_SIZES = [3, 50, 500, 5000]
+QUICK_SIZES = {"village": [10, 100, 1000], "vectorized_village": [10, 1000, 10000],
+               "planet_delivery": [3, 10, 30], "mined_zone": [3, 30, 100], "vectorized_mined_zone": [3, 100, 1000]}
+
+
+def load_module(name, path):
+    # Les TP ne sont pas des paquets (et TP3/main.py a un nom générique) : chargement direct par chemin
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def village_params(n):
+    # Proportions du paramétrage de base du TP1 : 25 villageois, 5 lycanthropes, 1 apothicaire, 2 chasseurs
+    n_lycanthropes = max(1, n * 5 // 33)
+    n_clerics = max(1, n // 33)
+    n_hunters = max(1, n * 2 // 33)
+    return {"n_villagers": max(0, n - n_lycanthropes - n_clerics - n_hunters), "n_lycanthropes": n_lycanthropes,
+            "n_clerics": n_clerics, "n_hunters": n_hunters}
+
+
+def village_suite():
+    village = load_module("village", os.path.join(ROOT, "TP1", "village.py"))
+    phases = [("Villager.step", village.Villager, "step"), ("Villager.attack", village.Villager, "attack"),
+              ("Cleric.step", village.Cleric, "step"), ("Hunter.step", village.Hunter, "step"),
+              ("collect", village.mesa.DataCollector, "collect")]
+    return village.Village, village_params, VILLAGE_SIZES, phases
+
+
+def vectorized_village_suite():
+    village = load_module("village", os.path.join(ROOT, "TP1", "village.py"))
+    model = village.VectorizedVillage
+    phases = [("wander", model, "wander"), ("interact", model, "interact"),
+              ("collect", village.mesa.DataCollector, "collect")]
+    return model, village_params, VILLAGE_SIZES, phases
+
+
+def planet_delivery_suite():
+    delivery = load_module("planet_delivery", os.path.join(ROOT, "TP2", "planet_delivery.py"))
+    phases = [("Ship.step", delivery.Ship, "step"), ("PlanetManager.step", delivery.PlanetManager, "step"),
+              ("SpaceRoadNetwork.step", delivery.SpaceRoadNetwork, "step"),
+              ("collect", delivery.DataCollector, "collect")]
+
+    def params(n):
+        return {"n_planets": n, "n_ships": 2 * n, "road_branching_factor": 0.5, "transport": "local"}
+    return delivery.PlanetDelivery, params, PLANET_SIZES, phases
+
+
+def mined_zone_params(n):
+    return {"n_robots": n, "n_obstacles": 5, "n_quicksand": 5, "n_mines": 3 * n, "speed": 15}
+
+
+def mined_zone_suite():
+    mined_zone = load_module("mined_zone", os.path.join(ROOT, "TP3", "main.py"))
+    robot = mined_zone.Robot
+    phases = [("Robot.step", robot, "step"), ("Robot.detect_robots", robot, "detect_robots"),
+              ("Robot.detect_obstacles", robot, "detect_obstacles"), ("Robot.blocked_arcs", robot, "blocked_arcs"),
+              ("Robot.detect_mines", robot, "detect_mines"),
+              ("Robot.detect_markers", robot, "detect_markers"), ("Robot.detect_quicksand", robot, "detect_quicksand"),
+              ("collect", mined_zone.DataCollector, "collect")]
+    return mined_zone.MinedZone, mined_zone_params, ROBOT_SIZES, phases
+
+
+def vectorized_mined_zone_suite():
+    mined_zone = load_module("mined_zone", os.path.join(ROOT, "TP3", "main.py"))
+    model = mined_zone.VectorizedMinedZone
+    phases = [("sense_quicksand", model, "sense_quicksand"), ("avoid_collisions", model, "avoid_collisions"),
+              ("seek_mines", model, "seek_mines"), ("follow_markers", model, "follow_markers"),
+              ("collect", mined_zone.DataCollector, "collect")]
+    return model, mined_zone_params, ROBOT_SIZES, phases
+
+
+SUITES = {"village": village_suite, "vectorized_village": vectorized_village_suite,
+          "planet_delivery": planet_delivery_suite, "mined_zone": mined_zone_suite,
+          "vectorized_mined_zone": vectorized_mined_zone_suite}
+
+
+@contextlib.contextmanager
+def timed_methods(phases, totals):
+    # Remplace temporairement chaque méthode par une version chronométrée (temps inclusif, appels imbriqués compris)
+    saved = []
+    for label, owner, name in phases:
+        original = getattr(owner, name)
+
+        def timed(*args, _original=original, _label=label, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                totals[_label] += time.perf_counter() - start
+        saved.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, timed)
+    try:
+        yield
+    finally:
+        for owner, name, original in reversed(saved):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+
+def bench_one(model_cls, params, phases, steps, seed):
+    start = time.perf_counter()
+    model = model_cls(**params, seed=seed, headless=True)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    done = model.run(steps)
+    elapsed = time.perf_counter() - start
+
+    totals = defaultdict(float)
+    model = model_cls(**params, seed=seed, headless=True)
+    with timed_methods(phases, totals):
+        start = time.perf_counter()
+        instrumented_steps = model.run(steps)
+        instrumented = time.perf_counter() - start
+
+    tracemalloc.start()
+    model = model_cls(**params, seed=seed, headless=True)
+    model.run(max(1, steps // 4))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"build_sec": build, "steps": done, "elapsed_sec": elapsed,
+            "steps_per_sec": done / elapsed if elapsed > 0 else None,
+            "phases_sec_per_step": {label: totals[label] / max(1, instrumented_steps) for label, _, _ in phases},
+            "instrumented_sec_per_step": instrumented / max(1, instrumented_steps),
+            "peak_memory_mb": peak / 2 ** 20}
+
+
+def bench_worker(name, size, steps, seed, connection):
+    model_cls, params, _, phases = SUITES[name]()
+    connection.send(bench_one(model_cls, params(size), phases, steps, seed))
+
+
+def bench_guarded(name, size, steps, seed, budget):
+    # bench_one dans un processus fils : renvoie (résultat, None), ou (None, raison) si le fils dépasse budget secondes
+    # ou meurt en route (manque de mémoire, exception)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=bench_worker, args=(name, size, steps, seed, sender), daemon=True)
+    process.start()
+    sender.close()
+    result, reason = None, None
+    try:
+        if receiver.poll(budget):
+            result = receiver.recv()
+        else:
+            reason = "over the {}s budget".format(budget)
+    except EOFError:
+        pass
+    process.join(0 if reason else None)
+    if process.is_alive():
+        process.kill()
+        process.join()
+    if result is None and reason is None:
+        reason = "worker exited with code {}".format(process.exitcode)
+    return result, reason
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["suite"], r["size"]): r for r in json.load(f)["results"]}
+    print("\n{:<20} {:>8} {:>14} {:>14} {:>8}".format("suite", "size", "before (st/s)", "after (st/s)", "ratio"))
+    for r in results:
+        old = baseline.get((r["suite"], r["size"]))
+        if old is None or not old.get("steps_per_sec") or not r.get("steps_per_sec"):
+            continue
+        print("{:<20} {:>8} {:>14.2f} {:>14.2f} {:>7.2f}x".format(r["suite"], r["size"], old["steps_per_sec"],
+                                                                  r["steps_per_sec"],
+                                                                  r["steps_per_sec"] / old["steps_per_sec"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmarks for Village, PlanetDelivery and MinedZone")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES),
+                        help="suite to run (repeatable, default: all)")
+    parser.add_argument("--sizes", type=int, nargs="+", help="population sizes (default: per-suite list)")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for CI")
+    parser.add_argument("--steps", type=int, default=20, help="steps per measured run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=600,
+                        help="seconds allowed per suite and size (all three runs), larger sizes are skipped after")
+    parser.add_argument("--output", default=None, help="JSON output path (default: benchmarks/results-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="previous JSON output to compare steps/sec against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+    for name in args.suite or sorted(SUITES):
+        try:
+            model_cls, params, sizes, phases = SUITES[name]()
+        except ImportError as e:
+            print("{}: skipped ({})".format(name, e))
+            continue
+        if args.sizes:
+            sizes = args.sizes
+        elif args.quick:
+            sizes = QUICK_SIZES[name]
+        skipped = None
+        for size in sorted(sizes):
+            result = {"suite": name, "size": size, "params": params(size)}
+            if skipped is None:
+                measures, skipped = bench_guarded(name, size, args.steps, args.seed, args.budget)
+            else:
+                measures = None
+            if measures is None:
+                result["skipped"] = skipped
+                results.append(result)
+                print("{:<20} {:>8} skipped: {}".format(name, size, skipped))
+                continue
+            result.update(measures)
+            results.append(result)
+            print("{:<20} {:>8} {:>10.2f} steps/s {:>10.1f} MB".format(name, size, result["steps_per_sec"] or 0,
+                                                                       result["peak_memory_mb"]))
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results-{}.json".format((commit or "unknown")[:8]))
+    with open(output, "w") as f:
+        json.dump({"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                   "steps": args.steps, "seed": args.seed, "results": results}, f, indent=2)
+    print("results written to " + output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()